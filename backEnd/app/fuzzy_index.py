@@ -0,0 +1,178 @@
+"""
+Typo tolerant name matching with a SymSpell like deletion index over the words of the folded names
+Every word is indexed by the strings obtained when deleting up to MAX_DISTANCE characters from its prefix,
+a search word is looked up through its own deletions so only the words sharing one of them are compared
+"""
+
+import utils
+
+MAX_DISTANCE = 2
+# Only the start of the words is indexed, longer words are still compared in full
+PREFIX_LENGTH = 7
+
+
+def get_max_distance(word):
+    """
+    Number of typos tolerated in a search word, short words have to be exact
+    """
+
+    if len(word) <= 3:
+        return 0
+    if len(word) <= 5:
+        return 1
+    return MAX_DISTANCE
+
+
+def get_deletions(word, max_distance):
+    """
+    Every string obtained by deleting up to max_distance characters of the word (the word included)
+    """
+
+    deletions = {word}
+    current = {word}
+    for _ in range(max_distance):
+        current = {
+            deletion[:i] + deletion[i + 1 :]
+            for deletion in current
+            if len(deletion) > 1
+            for i in range(len(deletion))
+        }
+        deletions |= current
+    return deletions
+
+
+def get_edit_distance(word1, word2, max_distance):
+    """
+    Damerau-Levenshtein distance (optimal string alignment) between the two words
+    Return max_distance + 1 as soon as it is exceeded
+    """
+
+    if abs(len(word1) - len(word2)) > max_distance:
+        return max_distance + 1
+
+    previous_previous = None
+    previous = list(range(len(word2) + 1))
+    for i in range(1, len(word1) + 1):
+        current = [i] + [0] * len(word2)
+        for j in range(1, len(word2) + 1):
+            cost = 0 if word1[i - 1] == word2[j - 1] else 1
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if (
+                i > 1
+                and j > 1
+                and word1[i - 1] == word2[j - 2]
+                and word1[i - 2] == word2[j - 1]
+            ):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+
+    return previous[-1]
+
+
+class Fuzzy_Index:
+    """
+    Deletion index over the names of a list of items (animes, songs or artists)
+    names: iterable of (item_id, name), an item can have several names
+    """
+
+    __slots__ = ["words", "deletions", "postings", "names"]
+
+    def __init__(self, names):
+        word_ids = {}
+        # Word of every word ID
+        self.words = []
+        # Deleted prefix -> IDs of the words it comes from
+        self.deletions = {}
+        # Word ID -> indexes of the names using it
+        self.postings = []
+        # (item_id, number of words) of every name
+        self.names = []
+
+        for item_id, name in names:
+            words = utils.fold_name(name).split()
+            if not words:
+                continue
+
+            name_index = len(self.names)
+            self.names.append((item_id, len(words)))
+
+            for word in words:
+                if word not in word_ids:
+                    word_ids[word] = len(self.words)
+                    self.words.append(word)
+                    self.postings.append([])
+                    for deletion in get_deletions(word[:PREFIX_LENGTH], MAX_DISTANCE):
+                        self.deletions.setdefault(deletion, []).append(word_ids[word])
+
+                postings = self.postings[word_ids[word]]
+                if not postings or postings[-1] != name_index:
+                    postings.append(name_index)
+
+    def get_close_words(self, word):
+        """
+        Return {word_id: distance} for the indexed words close enough to the search word
+        """
+
+        max_distance = get_max_distance(word)
+        prefix = word[:PREFIX_LENGTH]
+
+        close_words = {}
+        for deletion in get_deletions(prefix, max_distance):
+            for word_id in self.deletions.get(deletion, []):
+                if word_id in close_words:
+                    continue
+                distance = get_edit_distance(word, self.words[word_id], max_distance)
+                if distance <= max_distance:
+                    close_words[word_id] = distance
+        return close_words
+
+    def search(self, search, partial_match=True):
+        """
+        Return the IDs of the items having a name close to the search, the closest first
+        Every word of the search has to be close to a word of the name,
+        and without partial_match the name can't have other words
+        """
+
+        words = utils.fold_name(search).split()
+        if not words:
+            return []
+
+        name_distances = None
+        for word in words:
+            word_distances = {}
+            for word_id, distance in self.get_close_words(word).items():
+                for name_index in self.postings[word_id]:
+                    if distance < word_distances.get(name_index, MAX_DISTANCE + 1):
+                        word_distances[name_index] = distance
+
+            if name_distances is None:
+                name_distances = word_distances
+            else:
+                name_distances = {
+                    name_index: name_distances[name_index] + distance
+                    for name_index, distance in word_distances.items()
+                    if name_index in name_distances
+                }
+
+            if not name_distances:
+                return []
+
+        # (distance, name index) of the closest name of every item, the names of an item being indexed together
+        # the items keep the order they were indexed in for the same distance
+        item_distances = {}
+        for name_index, distance in name_distances.items():
+            item_id, nb_words = self.names[name_index]
+            if not partial_match and nb_words != len(words):
+                continue
+            if (
+                item_id not in item_distances
+                or (distance, name_index) < item_distances[item_id]
+            ):
+                item_distances[item_id] = (distance, name_index)
+
+        return sorted(item_distances, key=item_distances.get)
@@ -3,6 +3,31 @@ from datetime import datetime
 import timeit
 from datetime import datetime
 import re
+import random
+from itertools import chain
+from bisect import bisect_right
+import heapq
+
+# Relevance of a song for sort_by_relevance: every filter finding it adds its weight times the match score
+MATCH_SCORES = {"exact": 3, "prefix": 2, "partial": 1}
+FIELD_WEIGHTS = {"annId": 3, "Song Name": 3, "Anime": 2, "Artists": 2, "Composers": 1}
+# Added to the songs found by the annId lookup of the main filter
+MAIN_FILTER_BOOST = 1
+
+# Exceptions for groups that have line ups, but also songs with no line ups : they should be considered both a group and artist
+LINE_UP_EXCEPTIONS = frozenset(
+    [
+        33,  # Tokyo Konsei
+        215,  # Suginami
+        1736,  # JDK
+        4261,
+        7695,
+        6678,
+    ]
+)
+
+# Number of artists kept by a fuzzy artist or composer search, like the LIMIT of get_artist_ids_from_names
+MAX_FUZZY_ARTISTS = 50
 
 
 def add_main_log(
@@ -91,6 +116,92 @@ def is_ranked_time():
     return False
 
 
+# Searches estimated at SLOW_SEARCH_COST or more are run in the slow lane of the API
+SLOW_SEARCH_COST = 10
+
+
+def is_partial_match(search_filter):
+    """
+    Searches of 3 characters or less are always exact matches
+    """
+
+    if len(search_filter.search) <= 3:
+        return False
+    return search_filter.partial_match
+
+
+def get_artist_ids(snapshot, search, partial_match, fuzzy=False):
+    """
+    IDs of the artists matching the search, the closest ones first in fuzzy mode
+    """
+
+    if fuzzy:
+        return snapshot.fuzzy_indexes["artist"].search(search, partial_match)[
+            :MAX_FUZZY_ARTISTS
+        ]
+
+    return sql_calls.get_artist_ids_from_names(
+        snapshot.cursor(),
+        utils.get_folded_searches(search, swap_words=True),
+        partial_match,
+    )
+
+
+def estimate_search_cost(
+    snapshot,
+    anime_search_filters,
+    song_name_search_filters,
+    artist_search_filters,
+    composer_search_filters,
+):
+    """
+    Cheap estimate of the cost of a search, roughly in catalogue scans
+    Artist and composer filters are resolved to their IDs as each ID brings its groups, members and songs to check
+    The fuzzy indexes are built with the snapshot, fuzzy filters are looked up in them like the others
+    """
+
+    is_ranked = is_ranked_time()
+
+    cost = 0
+
+    # Anime and song names are matched against the whole catalogue, fuzzy ones are looked up in their index
+    if anime_search_filters:
+        cost += (
+            2
+            if is_partial_match(anime_search_filters) and not anime_search_filters.fuzzy
+            else 1
+        )
+    if song_name_search_filters and not is_ranked:
+        cost += (
+            2
+            if is_partial_match(song_name_search_filters)
+            and not song_name_search_filters.fuzzy
+            else 1
+        )
+
+    for search_filter in [artist_search_filters, composer_search_filters]:
+        if not search_filter or is_ranked:
+            continue
+
+        nb_artists = len(
+            get_artist_ids(
+                snapshot,
+                search_filter.search,
+                is_partial_match(search_filter),
+                search_filter.fuzzy,
+            )
+        )
+        cost += 1 + nb_artists // 5
+
+        # Every member is expanded, and a high max_other_artist keeps most of their songs to check
+        if search_filter.group_granularity > 0:
+            cost += (1 + nb_artists // 5) * (
+                2 if search_filter.max_other_artist > 2 else 1
+            )
+
+    return cost
+
+
 def get_duplicate_in_list(list, song):
     """
     Returns the index of the duplicate song in the list
@@ -123,14 +234,15 @@ def combine_results(
     artist_songs_list = [] if not artist_songs_list else artist_songs_list
     composer_songs_list = [] if not composer_songs_list else composer_songs_list
 
-    songId_done = []
+    # Without and_logic the lists can be generators, only pulled until max_nb_songs is reached
+    songId_done = set()
     final_song_list = []
-    for song in (
-        annId_songs_list
-        + anime_songs_list
-        + songName_songs_list
-        + artist_songs_list
-        + composer_songs_list
+    for song in chain(
+        annId_songs_list,
+        anime_songs_list,
+        songName_songs_list,
+        artist_songs_list,
+        composer_songs_list,
     ):
         if len(final_song_list) >= max_nb_songs:
             break
@@ -147,21 +259,21 @@ def combine_results(
                 and (not composer_songs_list or song in composer_songs_list)
             ):
                 if not ignore_duplicate or duplicate_ID == -1:
-                    songId_done.append(song[13])
+                    songId_done.add(song[13])
                     final_song_list.append(utils.format_song(artist_database, song))
                 else:
                     if final_song_list[duplicate_ID]["annId"] > song[0]:
-                        songId_done.append(song[13])
+                        songId_done.add(song[13])
                         final_song_list[duplicate_ID] = utils.format_song(
                             artist_database, song
                         )
         else:
             if not ignore_duplicate or duplicate_ID == -1:
-                songId_done.append(song[13])
+                songId_done.add(song[13])
                 final_song_list.append(utils.format_song(artist_database, song))
             else:
                 if final_song_list[duplicate_ID]["annId"] > song[0]:
-                    songId_done.append(song[13])
+                    songId_done.add(song[13])
                     final_song_list[duplicate_ID] = utils.format_song(
                         artist_database, song
                     )
@@ -169,179 +281,102 @@ def combine_results(
     return final_song_list
 
 
-def get_member_list_flat(art_database, artists, bottom=True):
-    # If bottom: will skip subgroups and go directly to the lower tier possible
-
-    member_list = []
+def get_line_ups_flat(artist_database, artist_ids, composers=False):
+    """
+    Flatten once per search the line ups the songs are checked against
+    Return {artist_id: [(member set, line up size), ...]}
+    """
 
-    for artist, line_up in artists:
-        if line_up == -1:
-            member_list.append(int(artist))
+    line_ups_flat = {}
+    for artist_id in artist_ids:
 
-        else:
-            if not bottom:
-                member_list.append(int(artist))
+        line_ups = [[(artist_id, -1)]]
 
-            for member in get_member_list_flat(
-                art_database,
-                art_database[str(artist)]["line_ups"][line_up]["members"],
-                bottom=bottom,
-            ):
-                member_list.append(int(member))
+        artist = artist_database[artist_id]
 
-    return member_list
+        if artist.line_ups:
 
+            if composers:
+                line_ups = [
+                    line_up.members
+                    for line_up in artist.line_ups
+                    # if line_up.line_up_type == "composers"  # TODO : add it once we start having more composer line up counterpart to normal groups
+                ]
 
-def compare_two_artist_list(list1, list2):
-    same_count = 0  # amount of people present in both
-    add_count = 0  # additional people in list1 compared to list2
+                # if composer_id in LINE_UP_EXCEPTIONS: TODO : add it once we start having more composer line up counterpart to normal groups
+                line_ups += [[(artist_id, -1)]]  # TODO
 
-    for artist in list1:
-        if artist not in list2:
-            add_count += 1
-        else:
-            same_count += 1
+            else:
+                line_ups = [
+                    line_up.members
+                    for line_up in artist.line_ups
+                    if line_up.line_up_type == "vocalists"
+                ]
+
+                if artist_id in LINE_UP_EXCEPTIONS:
+                    line_ups += [[(artist_id, -1)]]
+
+        line_ups_flat[artist_id] = [
+            (
+                frozenset(utils.get_member_list_flat(artist_database, line_up)),
+                len(line_up),
+            )
+            for line_up in line_ups
+        ]
 
-    return same_count, add_count
+    return line_ups_flat
 
 
-def check_meets_artists_requirements(
-    artist_database, song, artist_ids, group_granularity, max_other_artist
+def check_meets_line_ups_requirements(
+    song_members_flat, line_ups_flat, group_granularity, max_other_artist
 ):
+    """
+    Check the flattened members of a song against the flattened line ups of an artist
+    A member credited twice (ie. solo and through a group) counts twice, like in the song list
+    """
 
-    # Exceptions for groups that have line ups, but also songs with no line ups : they should be considered both a group and artist
-    LINE_UP_EXCEPTIONS = [
-        33,  # Tokyo Konsei
-        215,  # Suginami
-        1736,  # JDK
-        4261,
-        7695,
-        6678,
-    ]
-
-    song_artists = [
-        [artist, int(line_up)]
-        for artist, line_up in zip(song[23].split(","), song[24].split(","))
-    ]
-    song_artists_flat = get_member_list_flat(artist_database, song_artists)
-
-    for artist_id in artist_ids:
-
-        line_ups = [[[str(artist_id), -1]]]
+    members, member_set = song_members_flat
 
-        artist = artist_database[str(artist_id)]
+    for checked_set, line_up_size in line_ups_flat:
 
-        if artist["line_ups"]:
+        if len(member_set) == len(members):
+            present_artist = len(member_set & checked_set)
+        else:
+            present_artist = sum(member in checked_set for member in members)
+        additional_artist = len(members) - present_artist
 
-            line_ups = [
-                line_up["members"]
-                for line_up in artist["line_ups"]
-                if line_up["line_up_type"] == "vocalists"
-            ]
+        if (
+            present_artist >= 1
+            and additional_artist <= max_other_artist
+            and present_artist >= min(group_granularity, line_up_size)
+        ):
+            return True
 
-            if artist_id in LINE_UP_EXCEPTIONS:
-                line_ups += [[[str(artist_id), -1]]]
+    return False
 
-        for line_up in line_ups:
 
-            checked_list = get_member_list_flat(artist_database, line_up)
-            present_artist, additional_artist = compare_two_artist_list(
-                song_artists_flat, checked_list
-            )
+def check_meets_artists_requirements(
+    song_members_flat, artists_line_ups_flat, group_granularity, max_other_artist
+):
 
-            if (
-                present_artist >= 1
-                and additional_artist <= max_other_artist
-                and present_artist >= min(group_granularity, len(line_up))
-            ):
-                return True
+    for line_ups_flat in artists_line_ups_flat.values():
+        if check_meets_line_ups_requirements(
+            song_members_flat[0], line_ups_flat, group_granularity, max_other_artist
+        ):
+            return True
 
     return False
 
 
 def check_meets_composers_requirements(
-    artist_database, song, composer_ids, group_granularity, max_other_artist
+    song_members_flat, composers_line_ups_flat, group_granularity, max_other_artist
 ):
 
-    # Exceptions for groups that have line ups, but also songs with no line ups : they should be considered both a group and artist
-    LINE_UP_EXCEPTIONS = [
-        33,  # Tokyo Konsei
-        215,  # Suginami
-        1736,  # JDK
-        4261,
-        7695,
-        6678,
-    ]
-
-    song_composers = [
-        [artist, int(line_up)]
-        for artist, line_up in zip(song[27].split(","), song[28].split(","))
-    ]
-    song_artists_flat = get_member_list_flat(artist_database, song_composers)
-
-    for composer_id in composer_ids:
-
-        line_ups = [[[str(composer_id), -1]]]
-
-        artist = artist_database[str(composer_id)]
-
-        if artist["line_ups"]:
-
-            line_ups = [
-                line_up["members"]
-                for line_up in artist["line_ups"]
-                # if line_up["line_up_type"] == "composers"  # TODO : add it once we start having more composer line up counterpart to normal groups
-            ]
-
-            # if composer_id in LINE_UP_EXCEPTIONS: TODO : add it once we start having more composer line up counterpart to normal groups
-            line_ups += [[[str(composer_id), -1]]]  # TODO
-
-        for line_up in line_ups:
-            checked_list = get_member_list_flat(artist_database, line_up)
-            present_artist, additional_artist = compare_two_artist_list(
-                song_artists_flat, checked_list
-            )
-
-            if (
-                present_artist >= 1
-                and additional_artist <= max_other_artist
-                and present_artist >= min(group_granularity, len(line_up))
-            ):
-                return True
-
-    song_arrangers = [
-        [artist, int(line_up)]
-        for artist, line_up in zip(song[31].split(","), song[32].split(","))
-    ]
-    song_artists_flat = get_member_list_flat(artist_database, song_arrangers)
-
-    for arranger_id in composer_ids:
-
-        line_ups = [[[str(arranger_id), -1]]]
-
-        artist = artist_database[str(composer_id)]
-
-        if artist["line_ups"]:
-
-            line_ups = [
-                line_up["members"]
-                for line_up in artist["line_ups"]
-                # if line_up["line_up_type"] == "composers"  # TODO : add it once we start having more composer line up counterpart to normal groups
-            ]
-
-            # if composer_id in LINE_UP_EXCEPTIONS: TODO : add it once we start having more composer line up counterpart to normal groups
-            line_ups += [[[str(composer_id), -1]]]  # TODO
-
-        for line_up in line_ups:
-            checked_list = get_member_list_flat(artist_database, line_up)
-            present_artist, additional_artist = compare_two_artist_list(
-                song_artists_flat, checked_list
-            )
-
-            if (
-                present_artist >= 1
-                and additional_artist <= max_other_artist
-                and present_artist >= min(group_granularity, len(line_up))
+    # The composers and the arrangers of the song are both checked against the line ups of every composer
+    for line_ups_flat in composers_line_ups_flat.values():
+        for members_flat in song_members_flat[1:]:
+            if check_meets_line_ups_requirements(
+                members_flat, line_ups_flat, group_granularity, max_other_artist
             ):
                 return True
 
@@ -391,7 +426,7 @@ def get_all_groups(artist_id, artist_database, include_composers_groups=False):
     # TODO include_composers_groups do nothing yet, might be a problem in the long run to take into account composers groups
 
     # Get the groups for the current artist
-    for group in artist_database[str(artist_id)]["groups"]:
+    for group in artist_database[artist_id].groups:
 
         groups.append(group)
 
@@ -403,9 +438,7 @@ def get_all_groups(artist_id, artist_database, include_composers_groups=False):
 
 
 def process_artist(
-    cursor,
-    song_database,
-    artist_database,
+    snapshot,
     search,
     partial_match,
     authorized_types,
@@ -413,20 +446,30 @@ def process_artist(
     authorized_song_categories,
     group_granularity,
     max_other_artist,
+    candidate_songIds=None,
+    fuzzy=False,
 ):
-    artist_search = utils.get_regex_search(search, partial_match, swap_words=True)
+    song_database = snapshot.song_database
+    artist_database = snapshot.artist_database
+
+    artist_searches = utils.get_folded_searches(search, swap_words=True)
 
-    artist_ids = sql_calls.get_artist_ids_from_regex(cursor, artist_search)
+    artist_ids = get_artist_ids(snapshot, search, partial_match, fuzzy)
 
     # If no IDs found, fall back to indexing on songArtist string
     if not artist_ids:
-        artist_songs_list = sql_calls.get_song_list_from_songArtist(
-            cursor,
-            artist_search,
+        artist_songs_list = sql_calls.get_song_list_from_songArtist_name(
+            snapshot,
+            artist_searches,
+            partial_match,
             authorized_types,
             authorized_broadcasts,
             authorized_song_categories,
         )
+        if candidate_songIds is not None:
+            artist_songs_list = [
+                song for song in artist_songs_list if song[13] in candidate_songIds
+            ]
         return artist_songs_list, artist_ids
 
     # TODO Reuse those process for future processes such as check meet requirement and post process of songs
@@ -434,10 +477,10 @@ def process_artist(
     if group_granularity != 0:
         if group_granularity > 0:
             for artist in artist_ids:
-                if artist_database[str(artist)]["line_ups"]:
-                    for line_up in artist_database[str(artist)]["line_ups"]:
-                        for member in get_member_list_flat(
-                            artist_database, line_up["members"], bottom=False
+                if artist_database[artist].line_ups:
+                    for line_up in artist_database[artist].line_ups:
+                        for member in utils.get_member_list_flat(
+                            artist_database, line_up.members, bottom=False
                         ):
                             if member not in members:
                                 members.append(member)
@@ -450,9 +493,10 @@ def process_artist(
 
     # Extract every song IDs containing an artist we have
     songIds = sql_calls.get_songs_ids_from_artist_ids(
-        cursor,
-        list(set(artist_ids + [group[0] for group in all_groups] + members)),
+        snapshot, artist_ids + [group[0] for group in all_groups] + members
     )
+    if candidate_songIds is not None:
+        songIds = [songId for songId in songIds if songId in candidate_songIds]
 
     artist_songs_list = get_song_list_from_songIds_JSON(
         song_database,
@@ -462,12 +506,14 @@ def process_artist(
         authorized_song_categories,
     )
 
+    songs_members_flat = snapshot.songs_members_flat
+    artists_line_ups_flat = get_line_ups_flat(artist_database, artist_ids)
+
     final_song_list = []
     for song in artist_songs_list:
         if check_meets_artists_requirements(
-            artist_database,
-            song,
-            artist_ids,
+            songs_members_flat[song[13]],
+            artists_line_ups_flat,
             group_granularity,
             max_other_artist,
         ):
@@ -477,9 +523,7 @@ def process_artist(
 
 
 def process_composer(
-    cursor,
-    song_database,
-    artist_database,
+    snapshot,
     search,
     partial_match,
     arrangement,
@@ -488,11 +532,13 @@ def process_composer(
     authorized_song_categories,
     group_granularity,
     max_other_artist,
+    candidate_songIds=None,
+    fuzzy=False,
 ):
+    song_database = snapshot.song_database
+    artist_database = snapshot.artist_database
 
-    composer_search = utils.get_regex_search(search, partial_match, swap_words=True)
-
-    composer_ids = sql_calls.get_artist_ids_from_regex(cursor, composer_search)
+    composer_ids = get_artist_ids(snapshot, search, partial_match, fuzzy)
 
     # If no IDs found, do not fall back to raw string for computing time
     if not composer_ids:
@@ -503,10 +549,10 @@ def process_composer(
     if group_granularity != 0:
         if group_granularity > 0:
             for artist in composer_ids:
-                if artist_database[str(artist)]["line_ups"]:
-                    for line_up in artist_database[str(artist)]["line_ups"]:
-                        for member in get_member_list_flat(
-                            artist_database, line_up["members"], bottom=False
+                if artist_database[artist].line_ups:
+                    for line_up in artist_database[artist].line_ups:
+                        for member in utils.get_member_list_flat(
+                            artist_database, line_up.members, bottom=False
                         ):
                             if member not in members:
                                 members.append(member)
@@ -519,12 +565,14 @@ def process_composer(
 
     # Extract every song IDs containing an artist we have
     songIds = sql_calls.get_songs_ids_from_composing_team_ids(
-        cursor,
+        snapshot,
         composer_ids=list(
             set(composer_ids + [group[0] for group in all_groups] + members)
         ),
         arrangement=arrangement,
     )
+    if candidate_songIds is not None:
+        songIds = [songId for songId in songIds if songId in candidate_songIds]
 
     artist_songs_list = get_song_list_from_songIds_JSON(
         song_database,
@@ -534,12 +582,15 @@ def process_composer(
         authorized_song_categories,
     )
 
+    songs_members_flat = snapshot.songs_members_flat
+    composers_line_ups_flat = get_line_ups_flat(
+        artist_database, composer_ids, composers=True
+    )
     final_song_list = []
     for song in artist_songs_list:
         if check_meets_composers_requirements(
-            artist_database,
-            song,
-            composer_ids,
+            songs_members_flat[song[13]],
+            composers_line_ups_flat,
             group_granularity,
             max_other_artist,
         ):
@@ -548,235 +599,724 @@ def process_composer(
     return final_song_list, composer_ids
 
 
-def get_search_results(
-    anime_search_filters,
-    song_name_search_filters,
-    artist_search_filters,
-    composer_search_filters,
-    and_logic,
-    ignore_duplicate,
-    max_nb_songs,
-    authorized_types,
-    authorized_broadcasts,
-    authorized_song_categories,
+def is_authorized_song(
+    song, authorized_types, authorized_broadcasts, authorized_song_categories
 ):
-    startstart = timeit.default_timer()
+    """
+    Check the type, category and broadcast filters of a song
+    """
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
+    if song[16] not in authorized_types:
+        return False
 
-    song_database = sql_calls.extract_song_database()
-    anime_database = sql_calls.extract_anime_database()
-    artist_database = sql_calls.extract_artist_database()
+    if song[18] not in authorized_song_categories:
+        return False
 
-    add_main_log(
-        anime_search_filters,
-        song_name_search_filters,
-        artist_search_filters,
-        composer_search_filters,
-        and_logic,
-        ignore_duplicate,
-        authorized_types,
-        authorized_broadcasts,
-        authorized_song_categories,
-    )
+    if (not song[34] and not song[35]) and "Normal" not in authorized_broadcasts:
+        return False
 
-    is_ranked = is_ranked_time()
+    if song[34] and "Dub" not in authorized_broadcasts:
+        if not song[35] or "Rebroadcast" not in authorized_broadcasts:
+            return False
 
-    print(f"Preprocess: {round(timeit.default_timer() - startstart, 4)}", end=" | ")
-    start = timeit.default_timer()
+    if song[35] and "Rebroadcast" not in authorized_broadcasts:
+        return False
 
-    # Filters to process only on main filter
-    annId_songs_list = []
-    if (
-        anime_search_filters
-        and song_name_search_filters
-        and artist_search_filters
-        and anime_search_filters.search == song_name_search_filters.search
-        and song_name_search_filters.search == artist_search_filters.search
-    ):
-        # Links filter
-        if False:
-            songs = sql_calls.get_song_list_from_links(
-                cursor, anime_search_filters.search
-            )
-            if songs:
-                return [utils.format_song(artist_database, song) for song in songs]
+    return True
 
-        # annId Filter
-        if str(anime_search_filters.search).isdigit():
-            annId_songs_list = sql_calls.get_songs_list_from_annIds(
-                cursor,
-                [anime_search_filters.search],
-                authorized_types,
-                authorized_broadcasts,
-                authorized_song_categories,
-            )
 
-    print(f"annId on Main: {round(timeit.default_timer() - start, 4)}", end=" | ")
-    start = timeit.default_timer()
+def iter_anime_songs(
+    snapshot,
+    search,
+    partial_match,
+    authorized_types,
+    authorized_broadcasts,
+    authorized_song_categories,
+    candidate_songIds=None,
+):
 
-    # Anime Filter to process either way
-    anime_songs_list = []
-    if anime_search_filters:
+    anime_search = utils.get_regex_search(search, partial_match)
+    search_literals = utils.get_regex_literals(search)
 
-        if len(anime_search_filters.search) <= 3:
-            partial_match = False
-        else:
-            partial_match = anime_search_filters.partial_match
+    # Only the animes of the candidates are matched
+    candidate_annIds = None
+    if candidate_songIds is not None:
+        candidate_annIds = {
+            snapshot.song_database[songId][0] for songId in candidate_songIds
+        }
 
-        anime_search = utils.get_regex_search(
-            anime_search_filters.search, partial_match
-        )
+    for annId in snapshot.anime_database:
+        if candidate_annIds is not None and annId not in candidate_annIds:
+            continue
 
-        anime_songs_list = []
-        for annId in anime_database:
-            anime = anime_database[annId]
-            found = False
+        anime = snapshot.anime_database[annId]
+        found = False
+
+        for name in [anime["animeJPName"], anime["animeENName"]] + (
+            anime["animeAltNames"].split("\$")
+            if "animeAltNames" in anime and anime["animeAltNames"]
+            else []
+        ):
+            if not name or found:
+                continue
 
-            for name in [anime["animeJPName"], anime["animeENName"]] + (
-                anime["animeAltNames"].split("\$")
-                if "animeAltNames" in anime and anime["animeAltNames"]
-                else []
+            name = name.lower()
+            if all(literal in name for literal in search_literals) and re.match(
+                anime_search, name
             ):
-                if not name or found:
+                found = True
+
+        if found:
+            for song in anime["songs"]:
+
+                if candidate_songIds is not None and song[13] not in candidate_songIds:
                     continue
 
-                if re.match(anime_search, name.lower()):
-                    found = True
+                if is_authorized_song(
+                    song,
+                    authorized_types,
+                    authorized_broadcasts,
+                    authorized_song_categories,
+                ):
+                    yield song
 
-            if found:
-                for song in anime["songs"]:
 
-                    if song[16] not in authorized_types:
-                        continue
+def iter_blob_literal_matches(blob, offsets, literals, blob_search):
+    """
+    Matches of the blob regex among the names containing every literal of the search
+    The names are found with str.find on the longest literal, the regex only runs on them
+    """
 
-                    if song[18] not in authorized_song_categories:
-                        continue
+    position = blob.find(literals[0])
+    while position != -1:
+        line = bisect_right(offsets, position) - 1
+        start = offsets[line]
+        end = offsets[line + 1] - 1 if line + 1 < len(offsets) else len(blob)
 
-                    if (
-                        not song[34] and not song[35]
-                    ) and "Normal" not in authorized_broadcasts:
-                        continue
+        name = blob[start:end]
+        if all(literal in name for literal in literals[1:]):
+            match = blob_search.match(blob, start)
+            if match:
+                yield match
 
-                    if song[34] and "Dub" not in authorized_broadcasts:
-                        if not song[35] or "Rebroadcast" not in authorized_broadcasts:
-                            continue
+        position = blob.find(literals[0], end)
 
-                    if song[35] and "Rebroadcast" not in authorized_broadcasts:
-                        continue
 
-                    anime_songs_list.append(song)
+def iter_song_name_songs(
+    snapshot,
+    search,
+    partial_match,
+    authorized_types,
+    authorized_broadcasts,
+    authorized_song_categories,
+    candidate_songIds=None,
+):
 
-    print(f"Anime: {round(timeit.default_timer() - start, 4)}", end=" | ")
-    start = timeit.default_timer()
+    search_literals = utils.get_regex_literals(search)
 
-    # Song Name filter not available during ranked
-    songName_songs_list = []
-    if song_name_search_filters and not is_ranked:
+    # Without candidates, every song name is matched in a single scan of the song name blob
+    if candidate_songIds is None:
+        blob, offsets, songIds = snapshot.song_name_blob
+        songName_search = utils.get_blob_regex_search(search, partial_match)
 
-        if len(song_name_search_filters.search) <= 3:
-            partial_match = False
+        if search_literals:
+            matches = iter_blob_literal_matches(
+                blob, offsets, search_literals, songName_search
+            )
         else:
-            partial_match = song_name_search_filters.partial_match
+            matches = songName_search.finditer(blob)
 
-        songName_search = utils.get_regex_search(
-            song_name_search_filters.search, partial_match
-        )
+        for match in matches:
+            song = snapshot.song_database[
+                songIds[bisect_right(offsets, match.start()) - 1]
+            ]
+            if is_authorized_song(
+                song,
+                authorized_types,
+                authorized_broadcasts,
+                authorized_song_categories,
+            ):
+                yield song
+        return
 
-        songName_songs_list = []
-        for songId in song_database:
-            song = song_database[songId]
-            if re.match(songName_search, song[20].lower()):
+    songName_search = utils.get_regex_search(search, partial_match)
 
-                if song[16] not in authorized_types:
-                    continue
+    for songId in snapshot.song_database:
+        if songId not in candidate_songIds:
+            continue
 
-                if song[18] not in authorized_song_categories:
-                    continue
+        song = snapshot.song_database[songId]
+        name = song[20].lower()
+        if (
+            all(literal in name for literal in search_literals)
+            and re.match(songName_search, name)
+            and is_authorized_song(
+                song,
+                authorized_types,
+                authorized_broadcasts,
+                authorized_song_categories,
+            )
+        ):
+            yield song
 
-                if (
-                    not song[34] and not song[35]
-                ) and "Normal" not in authorized_broadcasts:
-                    continue
 
-                if song[34] and "Dub" not in authorized_broadcasts:
-                    if not song[35] or "Rebroadcast" not in authorized_broadcasts:
-                        continue
+def iter_fuzzy_anime_songs(
+    snapshot,
+    search,
+    partial_match,
+    authorized_types,
+    authorized_broadcasts,
+    authorized_song_categories,
+    candidate_songIds=None,
+):
+    """
+    Songs of the animes with a name close to the search, the closest animes first
+    """
 
-                if song[35] and "Rebroadcast" not in authorized_broadcasts:
-                    continue
+    for annId in snapshot.fuzzy_indexes["anime"].search(search, partial_match):
+        for song in snapshot.anime_database[annId]["songs"]:
 
-                songName_songs_list.append(song)
+            if candidate_songIds is not None and song[13] not in candidate_songIds:
+                continue
 
-    print(f"Song Name: {round(timeit.default_timer() - start, 4)}", end=" | ")
-    start = timeit.default_timer()
+            if is_authorized_song(
+                song,
+                authorized_types,
+                authorized_broadcasts,
+                authorized_song_categories,
+            ):
+                yield song
 
-    # Artist filter not available during ranked
-    artist_songs_list = []
-    artist_ids = None
 
-    if artist_search_filters and not is_ranked:
+def iter_fuzzy_song_name_songs(
+    snapshot,
+    search,
+    partial_match,
+    authorized_types,
+    authorized_broadcasts,
+    authorized_song_categories,
+    candidate_songIds=None,
+):
+    """
+    Songs with a name close to the search, the closest first
+    """
 
-        if len(artist_search_filters.search) <= 3:
-            partial_match = False
-        else:
-            partial_match = artist_search_filters.partial_match
+    for songId in snapshot.fuzzy_indexes["song"].search(search, partial_match):
+        if candidate_songIds is not None and songId not in candidate_songIds:
+            continue
 
-        artist_songs_list, artist_ids = process_artist(
-            cursor,
-            song_database,
-            artist_database,
-            artist_search_filters.search,
-            partial_match,
-            authorized_types,
-            authorized_broadcasts,
-            authorized_song_categories,
-            artist_search_filters.group_granularity,
-            artist_search_filters.max_other_artist,
+        song = snapshot.song_database[songId]
+        if is_authorized_song(
+            song, authorized_types, authorized_broadcasts, authorized_song_categories
+        ):
+            yield song
+
+
+def iter_original_name_anime_songs(
+    snapshot,
+    search,
+    partial_match,
+    authorized_types,
+    authorized_broadcasts,
+    authorized_song_categories,
+    candidate_songIds=None,
+):
+    """
+    Songs of the animes matching a search in kana or kanji, looked up in the full-text anime names
+    """
+
+    annIds = set(
+        sql_calls.get_ids_from_names(
+            snapshot.cursor(),
+            "anime_names_fts",
+            "annId",
+            utils.get_folded_searches(search),
+            partial_match,
+        )
+    )
+
+    for annId in snapshot.anime_database:
+        if annId not in annIds:
+            continue
+
+        for song in snapshot.anime_database[annId]["songs"]:
+
+            if candidate_songIds is not None and song[13] not in candidate_songIds:
+                continue
+
+            if is_authorized_song(
+                song,
+                authorized_types,
+                authorized_broadcasts,
+                authorized_song_categories,
+            ):
+                yield song
+
+
+def iter_original_name_song_name_songs(
+    snapshot,
+    search,
+    partial_match,
+    authorized_types,
+    authorized_broadcasts,
+    authorized_song_categories,
+    candidate_songIds=None,
+):
+    """
+    Songs matching a search in kana or kanji, looked up in the full-text song names
+    """
+
+    songIds = set(
+        sql_calls.get_ids_from_names(
+            snapshot.cursor(),
+            "song_names_fts",
+            "song_id",
+            utils.get_folded_searches(search),
+            partial_match,
+        )
+    )
+
+    for songId in snapshot.song_database:
+        if songId not in songIds:
+            continue
+
+        if candidate_songIds is not None and songId not in candidate_songIds:
+            continue
+
+        song = snapshot.song_database[songId]
+        if is_authorized_song(
+            song, authorized_types, authorized_broadcasts, authorized_song_categories
+        ):
+            yield song
+
+
+def iter_filter_songs(process):
+    """
+    Songs of a filter, only computed once combine_results starts pulling them
+    """
+
+    yield from process()
+
+
+def estimate_anime_nb_songs(snapshot, search_filter):
+    """
+    Rough number of songs found by the anime filter, from its matches in the full-text anime names
+    """
+
+    if search_filter.fuzzy:
+        nb_animes = len(
+            snapshot.fuzzy_indexes["anime"].search(
+                search_filter.search, is_partial_match(search_filter)
+            )
+        )
+    else:
+        nb_animes = sql_calls.get_name_match_count(
+            snapshot.cursor(),
+            "anime_names_fts",
+            "annId",
+            utils.get_folded_searches(search_filter.search),
+            is_partial_match(search_filter),
+        )
+    return (
+        nb_animes * len(snapshot.song_database) // max(len(snapshot.anime_database), 1)
+    )
+
+
+def estimate_song_name_nb_songs(snapshot, search_filter):
+    """
+    Rough number of songs found by the song name filter, from its matches in the full-text song names
+    """
+
+    if search_filter.fuzzy:
+        return len(
+            snapshot.fuzzy_indexes["song"].search(
+                search_filter.search, is_partial_match(search_filter)
+            )
+        )
+
+    return sql_calls.get_name_match_count(
+        snapshot.cursor(),
+        "song_names_fts",
+        "song_id",
+        utils.get_folded_searches(search_filter.search),
+        is_partial_match(search_filter),
+    )
+
+
+def estimate_artist_nb_songs(snapshot, search_filter):
+    """
+    Rough number of songs found by the artist filter, from the songs of the artists it matches
+    (their groups and members are not counted)
+    """
+
+    artist_searches = utils.get_folded_searches(search_filter.search, swap_words=True)
+    partial_match = is_partial_match(search_filter)
+
+    artist_ids = get_artist_ids(
+        snapshot, search_filter.search, partial_match, search_filter.fuzzy
+    )
+    if not artist_ids:
+        return sql_calls.get_name_match_count(
+            snapshot.cursor(),
+            "song_artists_fts",
+            "song_id",
+            artist_searches,
+            partial_match,
+        )
+
+    return len(sql_calls.get_songs_ids_from_artist_ids(snapshot, artist_ids))
+
+
+def estimate_composer_nb_songs(snapshot, search_filter):
+    """
+    Rough number of songs found by the composer filter, from the songs of the composers it matches
+    """
+
+    composer_ids = get_artist_ids(
+        snapshot,
+        search_filter.search,
+        is_partial_match(search_filter),
+        search_filter.fuzzy,
+    )
+    if not composer_ids:
+        return 0
+
+    return len(
+        sql_calls.get_songs_ids_from_composing_team_ids(
+            snapshot, composer_ids, search_filter.arrangement
         )
+    )
+
+
+def get_intersection_songs_lists(filter_processes, estimated_nb_songs):
+    """
+    Compute the filters of an intersection from the most selective one,
+    the next ones are only checked against the songs found so far (the candidates)
+    combine_results ignores a filter without any result, so a filter finding nothing
+    among the candidates is computed in full to know if it has results elsewhere
+    Return None when the intersection is empty
+    """
 
-    print(f"Artists: {round(timeit.default_timer() - start, 4)}", end=" | ")
     start = timeit.default_timer()
 
-    # Composer filter not available during ranked
-    composer_songs_list = []
-    composer_ids = None
+    songs_lists = {}
+    candidate_songIds = None
+    for name in sorted(filter_processes, key=lambda name: estimated_nb_songs[name]):
 
-    if composer_search_filters and not is_ranked:
+        songs_list = list(filter_processes[name](candidate_songIds))
+
+        if candidate_songIds is not None and not songs_list:
+            if any(filter_processes[name]()):
+                print(f"{name}: {round(timeit.default_timer() - start, 4)}", end=" | ")
+                return None
 
-        if len(composer_search_filters.search) <= 3:
-            partial_match = False
+        elif songs_list:
+            candidate_songIds = {song[13] for song in songs_list}
+
+        songs_lists[name] = songs_list
+
+        print(f"{name}: {round(timeit.default_timer() - start, 4)}", end=" | ")
+        start = timeit.default_timer()
+
+    return songs_lists
+
+
+def get_field_names(field, song, artist_database):
+    """
+    Names of the song a filter matches, romaji and original ones
+    """
+
+    if field == "Anime":
+        return [song[5], song[6], song[7]] + [
+            name
+            for alt_names in [song[8], song[9]]
+            if alt_names
+            for name in alt_names.split("\$")
+        ]
+
+    if field == "Song Name":
+        return [song[19], song[20]]
+
+    if field == "Artists":
+        return [song[21], song[22]] + [
+            name for artist_id in song[23] for name in artist_database[artist_id].names
+        ]
+
+    return [song[25], song[26], song[29], song[30]] + [
+        name
+        for artist_id in song[27] + song[31]
+        for name in artist_database[artist_id].names
+    ]
+
+
+def get_match_score(folded_searches, names, name_keys):
+    """
+    Best match of the searches among the names: exact, prefix or partial
+    (a song found through a group or a member of the searched artist is a partial match)
+    """
+
+    keys = [key for name in names if name for key in name_keys[name]]
+
+    if any(key in folded_searches for key in keys):
+        return MATCH_SCORES["exact"]
+    if any(key.startswith(search) for key in keys for search in folded_searches):
+        return MATCH_SCORES["prefix"]
+    return MATCH_SCORES["partial"]
+
+
+def iter_songs_by_relevance(
+    snapshot, annId_songs_list, songs_lists, search_filters, and_logic
+):
+    """
+    Songs found by the filters, the most relevant first and in combine_results order for the same relevance
+    The songs are only popped from the heap as far as combine_results needs them, so only the top ones are sorted
+    """
+
+    annId_songIds = {song[13] for song in annId_songs_list}
+    songIds_found = {
+        field: {song[13] for song in songs_list}
+        for field, songs_list in songs_lists.items()
+    }
+    folded_searches = {
+        field: utils.get_folded_searches(search_filters[field].search, swap_words=True)
+        for field in songs_lists
+    }
+
+    heap = []
+    songId_done = set()
+    for song in chain(annId_songs_list, *songs_lists.values()):
+        if song[13] in songId_done:
+            continue
+        songId_done.add(song[13])
+
+        # Filters without results are ignored, like in combine_results
+        if and_logic and not all(
+            song[13] in songIds for songIds in songIds_found.values() if songIds
+        ):
+            continue
+
+        score = 0
+        if song[13] in annId_songIds:
+            score += FIELD_WEIGHTS["annId"] * MATCH_SCORES["exact"] + MAIN_FILTER_BOOST
+        for field, songIds in songIds_found.items():
+            if song[13] in songIds:
+                score += FIELD_WEIGHTS[field] * get_match_score(
+                    folded_searches[field],
+                    get_field_names(field, song, snapshot.artist_database),
+                    snapshot.name_keys,
+                )
+
+        heap.append((-score, len(heap), song))
+
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def get_search_results(
+    anime_search_filters,
+    song_name_search_filters,
+    artist_search_filters,
+    composer_search_filters,
+    and_logic,
+    ignore_duplicate,
+    max_nb_songs,
+    authorized_types,
+    authorized_broadcasts,
+    authorized_song_categories,
+    sort_by_relevance=False,
+):
+    startstart = timeit.default_timer()
+
+    # Every filter reads the same snapshot even if the database is swapped during the search
+    snapshot = sql_calls.get_database_snapshot()
+    artist_database = snapshot.artist_database
+
+    add_main_log(
+        anime_search_filters,
+        song_name_search_filters,
+        artist_search_filters,
+        composer_search_filters,
+        and_logic,
+        ignore_duplicate,
+        authorized_types,
+        authorized_broadcasts,
+        authorized_song_categories,
+    )
+
+    is_ranked = is_ranked_time()
+
+    print(f"Preprocess: {round(timeit.default_timer() - startstart, 4)}", end=" | ")
+    start = timeit.default_timer()
+
+    # Filters to process only on main filter
+    annId_songs_list = []
+    if (
+        anime_search_filters
+        and song_name_search_filters
+        and artist_search_filters
+        and anime_search_filters.search == song_name_search_filters.search
+        and song_name_search_filters.search == artist_search_filters.search
+    ):
+        # Links filter
+        songs = sql_calls.get_song_list_from_links(
+            snapshot, anime_search_filters.search
+        )
+        if songs:
+            return [utils.format_song(artist_database, song) for song in songs]
+
+        # annId Filter
+        if str(anime_search_filters.search).isdigit():
+            annId_songs_list = sql_calls.get_songs_list_from_annIds(
+                snapshot,
+                [anime_search_filters.search],
+                authorized_types,
+                authorized_broadcasts,
+                authorized_song_categories,
+            )
+
+    print(f"annId on Main: {round(timeit.default_timer() - start, 4)}", end=" | ")
+    start = timeit.default_timer()
+
+    # Filters to process, the song name, artist and composer filters are not available during ranked
+    filter_processes = {}
+
+    if anime_search_filters:
+        if anime_search_filters.fuzzy:
+            iter_anime = iter_fuzzy_anime_songs
+        elif utils.is_original_script(anime_search_filters.search):
+            iter_anime = iter_original_name_anime_songs
         else:
-            partial_match = composer_search_filters.partial_match
+            iter_anime = iter_anime_songs
+        filter_processes["Anime"] = lambda candidate_songIds=None: iter_anime(
+            snapshot,
+            anime_search_filters.search,
+            is_partial_match(anime_search_filters),
+            authorized_types,
+            authorized_broadcasts,
+            authorized_song_categories,
+            candidate_songIds,
+        )
 
-        composer_songs_list, composer_ids = process_composer(
-            cursor,
-            song_database,
-            artist_database,
+    if song_name_search_filters and not is_ranked:
+        if song_name_search_filters.fuzzy:
+            iter_song_name = iter_fuzzy_song_name_songs
+        elif utils.is_original_script(song_name_search_filters.search):
+            iter_song_name = iter_original_name_song_name_songs
+        else:
+            iter_song_name = iter_song_name_songs
+        filter_processes["Song Name"] = lambda candidate_songIds=None: iter_song_name(
+            snapshot,
+            song_name_search_filters.search,
+            is_partial_match(song_name_search_filters),
+            authorized_types,
+            authorized_broadcasts,
+            authorized_song_categories,
+            candidate_songIds,
+        )
+
+    if artist_search_filters and not is_ranked:
+        filter_processes["Artists"] = lambda candidate_songIds=None: process_artist(
+            snapshot,
+            artist_search_filters.search,
+            is_partial_match(artist_search_filters),
+            authorized_types,
+            authorized_broadcasts,
+            authorized_song_categories,
+            artist_search_filters.group_granularity,
+            artist_search_filters.max_other_artist,
+            candidate_songIds,
+            artist_search_filters.fuzzy,
+        )[0]
+
+    if composer_search_filters and not is_ranked:
+        filter_processes["Composers"] = lambda candidate_songIds=None: process_composer(
+            snapshot,
             composer_search_filters.search,
-            partial_match,
+            is_partial_match(composer_search_filters),
             composer_search_filters.arrangement,
             authorized_types,
             authorized_broadcasts,
             authorized_song_categories,
             composer_search_filters.group_granularity,
             composer_search_filters.max_other_artist,
+            candidate_songIds,
+            composer_search_filters.fuzzy,
+        )[0]
+
+    if and_logic and len(filter_processes) > 1:
+        estimated_nb_songs = {
+            "Anime": lambda: estimate_anime_nb_songs(snapshot, anime_search_filters),
+            "Song Name": lambda: estimate_song_name_nb_songs(
+                snapshot, song_name_search_filters
+            ),
+            "Artists": lambda: estimate_artist_nb_songs(
+                snapshot, artist_search_filters
+            ),
+            "Composers": lambda: estimate_composer_nb_songs(
+                snapshot, composer_search_filters
+            ),
+        }
+        songs_lists = get_intersection_songs_lists(
+            filter_processes,
+            {name: estimated_nb_songs[name]() for name in filter_processes},
         )
+    elif and_logic or sort_by_relevance:
+        songs_lists = {}
+        for name, process in filter_processes.items():
+            songs_lists[name] = list(process())
+            print(f"{name}: {round(timeit.default_timer() - start, 4)}", end=" | ")
+            start = timeit.default_timer()
+    else:
+        # The filters are computed in order by combine_results and stop once it has enough songs
+        songs_lists = {
+            name: iter_filter_songs(process)
+            for name, process in filter_processes.items()
+        }
 
-    print(f"Composers: {round(timeit.default_timer() - start, 4)}", end=" | ")
     start = timeit.default_timer()
 
-    song_list = combine_results(
-        artist_database,
-        annId_songs_list,
-        anime_songs_list,
-        songName_songs_list,
-        artist_songs_list,
-        composer_songs_list,
-        and_logic,
-        ignore_duplicate,
-        max_nb_songs,
-    )
+    if songs_lists is None:
+        # A filter has no song in common with the others
+        songs_lists = {}
+        annId_songs_list = []
+
+    if sort_by_relevance:
+        # The filters are already applied, combine_results only keeps and formats the top songs
+        song_list = combine_results(
+            artist_database,
+            iter_songs_by_relevance(
+                snapshot,
+                annId_songs_list,
+                songs_lists,
+                {
+                    "Anime": anime_search_filters,
+                    "Song Name": song_name_search_filters,
+                    "Artists": artist_search_filters,
+                    "Composers": composer_search_filters,
+                },
+                and_logic,
+            ),
+            [],
+            [],
+            [],
+            [],
+            False,
+            ignore_duplicate,
+            max_nb_songs,
+        )
+    else:
+        song_list = combine_results(
+            artist_database,
+            annId_songs_list,
+            songs_lists.get("Anime", []),
+            songs_lists.get("Song Name", []),
+            songs_lists.get("Artists", []),
+            songs_lists.get("Composers", []),
+            and_logic,
+            ignore_duplicate,
+            max_nb_songs,
+        )
 
     print(f"Post Process: {round(timeit.default_timer() - start, 4)}", end=" | ")
     start = timeit.default_timer()
@@ -802,9 +1342,8 @@ def get_artists_ids_song_list(
 ):
     start = timeit.default_timer()
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
-
-    artist_database = sql_calls.extract_artist_database()
+    snapshot = sql_calls.get_database_snapshot()
+    artist_database = snapshot.artist_database
 
     print("-------------------------")
     print("Date: ", str(datetime.now().strftime("%d/%m/%Y %H:%M:%S")))
@@ -819,37 +1358,25 @@ def get_artists_ids_song_list(
 
     groups = []
     for artist in artist_ids:
-        for group in artist_database[str(artist)]["groups"]:
+        for group in artist_database[artist].groups:
             groups.append(group)
 
-    songIds = sql_calls.get_songs_ids_from_artist_ids(
-        cursor, list(set(artist_ids + [group[0] for group in groups]))
+    # Songs of the artists, and of their groups only with the line ups they are in
+    songIds = sorted(
+        set(sql_calls.get_songs_ids_from_artist_ids(snapshot, artist_ids))
+        | set(sql_calls.get_songs_ids_from_line_ups(snapshot, "artist", groups))
     )
 
-    song_database = sql_calls.extract_song_database()
-
     songs = get_song_list_from_songIds_JSON(
-        song_database,
+        snapshot.song_database,
         songIds,
         authorized_types,
         authorized_broadcasts,
         authorized_song_categories,
     )
 
-    final_songs = []
-    for song in songs:
-        flag = False
-        for artist, line_up in zip(song[23].split(","), song[24].split(",")):
-            if int(artist) in artist_ids:
-                flag = True
-            for group, group_line_up in groups:
-                if artist == group and int(line_up) == group_line_up:
-                    flag = True
-        if flag:
-            final_songs.append(song)
-
     final_songs = combine_results(
-        artist_database, final_songs, [], [], [], [], False, ignore_duplicate
+        artist_database, songs, [], [], [], [], False, ignore_duplicate
     )
 
     stop = timeit.default_timer()
@@ -870,9 +1397,8 @@ def get_composer_ids_song_list(
 ):
     start = timeit.default_timer()
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
-
-    artist_database = sql_calls.extract_artist_database()
+    snapshot = sql_calls.get_database_snapshot()
+    artist_database = snapshot.artist_database
 
     print("-------------------------")
     print("Date: ", str(datetime.now().strftime("%d/%m/%Y %H:%M:%S")))
@@ -887,42 +1413,32 @@ def get_composer_ids_song_list(
 
     groups = []
     for artist in composer_ids:
-        for group in artist_database[str(artist)]["groups"]:
+        for group in artist_database[artist].groups:
             groups.append(group)
 
     songIds = sql_calls.get_songs_ids_from_composing_team_ids(
-        cursor, list(set(composer_ids + [group[0] for group in groups])), arrangement
+        snapshot, composer_ids + [group[0] for group in groups], arrangement
     )
 
-    song_database = sql_calls.extract_song_database()
-
     songs = get_song_list_from_songIds_JSON(
-        song_database,
+        snapshot.song_database,
         songIds,
         authorized_types,
         authorized_broadcasts,
         authorized_song_categories,
     )
 
+    composer_ids_set = set(composer_ids)
+    groups_set = set(groups)
+
     final_songs = []
     for song in songs:
-        flag = False
-        for composer, line_up in zip(song[27].split(","), song[28].split(",")):
-            if int(composer) in composer_ids:
-                flag = True
-            for group, group_line_up in groups:
-                if composer == group and int(line_up) == group_line_up:
-                    flag = True
-
-        for arranger, line_up in zip(song[31].split(","), song[32].split(",")):
-            if int(arranger) in composer_ids:
-                flag = True
-            for group, group_line_up in groups:
-                if arranger == group and int(line_up) == group_line_up:
-                    flag = True
-
-        if flag:
-            final_songs.append(song)
+        for composer, line_up in chain(
+            zip(song[27], song[28]), zip(song[31], song[32])
+        ):
+            if composer in composer_ids_set or (composer, line_up) in groups_set:
+                final_songs.append(song)
+                break
 
     final_songs = combine_results(
         artist_database, final_songs, [], [], [], [], False, ignore_duplicate
@@ -945,9 +1461,8 @@ def get_annId_song_list(
 ):
     start = timeit.default_timer()
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
-
-    artist_database = sql_calls.extract_artist_database()
+    snapshot = sql_calls.get_database_snapshot()
+    artist_database = snapshot.artist_database
 
     print("-------------------------")
     print("Date: ", str(datetime.now().strftime("%d/%m/%Y %H:%M:%S")))
@@ -961,7 +1476,7 @@ def get_annId_song_list(
         return []
 
     songs = sql_calls.get_songs_list_from_annIds(
-        cursor,
+        snapshot,
         [annId],
         authorized_types,
         authorized_broadcasts,
@@ -990,9 +1505,8 @@ def get_malIds_song_list(
 
     start = timeit.default_timer()
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
-
-    artist_database = sql_calls.extract_artist_database()
+    snapshot = sql_calls.get_database_snapshot()
+    artist_database = snapshot.artist_database
 
     print("-------------------------")
     print("Date: ", str(datetime.now().strftime("%d/%m/%Y %H:%M:%S")))
@@ -1007,7 +1521,7 @@ def get_malIds_song_list(
             return []
 
     songs = sql_calls.get_songs_list_from_malIds(
-        cursor,
+        snapshot,
         malIds,
         authorized_types,
         authorized_broadcasts,
@@ -1035,3 +1549,130 @@ def get_malIds_song_list(
     print(f"nb_results: {len(songs)}")
 
     return songs
+
+
+def get_external_ids_song_list(
+    external_ids,
+    ignore_duplicate,
+    authorized_types,
+    authorized_broadcasts,
+    authorized_song_categories,
+):
+    """
+    Return the songs of the animes matching any of the external IDs
+    external_ids maps an animes column of sql_calls.EXTERNAL_ID_COLUMNS to a list of IDs
+    """
+
+    start = timeit.default_timer()
+
+    snapshot = sql_calls.get_database_snapshot()
+    artist_database = snapshot.artist_database
+    anime_database = snapshot.anime_database
+    external_id_maps = snapshot.external_id_maps
+
+    print("-------------------------")
+    print("Date: ", str(datetime.now().strftime("%d/%m/%Y %H:%M:%S")))
+    print(
+        "external_ids_filter: "
+        + " | ".join(f"{column}: {len(ids)}" for column, ids in external_ids.items())
+    )
+    print(f"ignore_dups: {ignore_duplicate}", end=" | ")
+    print(f"types: {authorized_types}", end=" | ")
+    print(f"broadcasts: {authorized_broadcasts}", end=" | ")
+    print(f"song_categories: {authorized_song_categories}")
+
+    # Animes are kept in the order of the lists, each of them once
+    annIds = {}
+    for column, ids in external_ids.items():
+        for external_id in ids:
+            for annId in external_id_maps[column].get(external_id, []):
+                annIds[annId] = True
+
+    songIds = [
+        song[13]
+        for annId in annIds
+        if annId in anime_database
+        for song in anime_database[annId]["songs"]
+    ]
+
+    songs = get_song_list_from_songIds_JSON(
+        snapshot.song_database,
+        songIds,
+        authorized_types,
+        authorized_broadcasts,
+        authorized_song_categories,
+    )
+
+    songs = combine_results(
+        artist_database,
+        songs,
+        [],
+        [],
+        [],
+        [],
+        False,
+        ignore_duplicate,
+        max_nb_songs=len(songs),
+    )
+
+    stop = timeit.default_timer()
+
+    print(f"computing_time: {round(stop - start, 4)}", end=" | ")
+    print(f"nb_results: {len(songs)}")
+
+    return songs
+
+
+def get_random_song_list(
+    nb_songs,
+    seed,
+    authorized_types,
+    authorized_broadcasts,
+    authorized_song_categories,
+):
+    start = timeit.default_timer()
+
+    snapshot = sql_calls.get_database_snapshot()
+    artist_database = snapshot.artist_database
+    song_database = snapshot.song_database
+    song_buckets = snapshot.song_buckets
+
+    print("-------------------------")
+    print("Date: ", str(datetime.now().strftime("%d/%m/%Y %H:%M:%S")))
+    print(f"random_songs: {nb_songs}", end=" | ")
+    print(f"seed: {seed}", end=" | ")
+    print(f"types: {authorized_types}", end=" | ")
+    print(f"broadcasts: {authorized_broadcasts}", end=" | ")
+    print(f"song_categories: {authorized_song_categories}")
+
+    # Only keep the buckets matching the filters, in a stable order so a seed always gives the same songs
+    buckets = [
+        song_buckets[key]
+        for key in sorted(song_buckets, key=str)
+        if key[0] in authorized_types
+        and key[1] in authorized_broadcasts
+        and key[2] in authorized_song_categories
+    ]
+
+    bucket_ends = []
+    nb_candidates = 0
+    for bucket in buckets:
+        nb_candidates += len(bucket)
+        bucket_ends.append(nb_candidates)
+
+    rng = random.Random(seed) if seed is not None else random
+
+    songs = []
+    for index in rng.sample(range(nb_candidates), min(nb_songs, nb_candidates)):
+        bucket_id = bisect_right(bucket_ends, index)
+        bucket_start = bucket_ends[bucket_id - 1] if bucket_id else 0
+        songs.append(song_database[buckets[bucket_id][index - bucket_start]])
+
+    song_list = [utils.format_song(artist_database, song) for song in songs]
+
+    stop = timeit.default_timer()
+
+    print(f"computing_time: {round(stop - start, 4)}", end=" | ")
+    print(f"nb_results: {len(song_list)}")
+
+    return song_list
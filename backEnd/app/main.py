@@ -1,5 +1,8 @@
 from __future__ import annotations
-from fastapi import FastAPI
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, Field
@@ -7,7 +10,6 @@ from typing import List, Optional
 
 import get_search_result
 import sql_calls, utils
-from random import randrange
 
 
 class Search_Filter(BaseModel):
@@ -24,6 +26,10 @@ class Search_Filter(BaseModel):
     # for composer search
     arrangement: Optional[bool] = True
 
+    # Typo tolerant search, names are matched word by word with up to 2 typos per word, closest first
+    # partial_match then allows the names to have other words
+    fuzzy: Optional[bool] = False
+
     class Config:
         # This will search for every fripSide song, as well as every Yoshino Nanjo song with not more than 2 other artists
         schema_extra = {
@@ -46,6 +52,10 @@ class Search_Request(BaseModel):
 
     ignore_duplicate: Optional[bool] = False
 
+    # Most relevant songs first (exact name matches, then prefixes, then partial matches)
+    # instead of the annId, anime, song name, artist, composer order
+    sort_by_relevance: Optional[bool] = False
+
     opening_filter: Optional[bool] = True
     ending_filter: Optional[bool] = True
     insert_filter: Optional[bool] = True
@@ -153,6 +163,47 @@ class malIds_Search_Request(BaseModel):
     character: Optional[bool] = True
 
 
+class External_Ids_Search_Request(BaseModel):
+    # Any number of IDs, the songs of every anime matching one of them are returned
+    malIds: List[int] = []
+    anidbIds: List[int] = []
+    anilistIds: List[int] = []
+    kitsuIds: List[int] = []
+    ignore_duplicate: Optional[bool] = False
+
+    opening_filter: Optional[bool] = True
+    ending_filter: Optional[bool] = True
+    insert_filter: Optional[bool] = True
+
+    normal_broadcast: Optional[bool] = True
+    dub: Optional[bool] = True
+    rebroadcast: Optional[bool] = True
+
+    standard: Optional[bool] = True
+    instrumental: Optional[bool] = True
+    chanting: Optional[bool] = True
+    character: Optional[bool] = True
+
+
+class Random_Songs_Request(BaseModel):
+    nb_songs: Optional[int] = Field(50, ge=1, le=500)
+    # Same seed and filters will always return the same songs
+    seed: Optional[int] = None
+
+    opening_filter: Optional[bool] = True
+    ending_filter: Optional[bool] = True
+    insert_filter: Optional[bool] = True
+
+    normal_broadcast: Optional[bool] = True
+    dub: Optional[bool] = True
+    rebroadcast: Optional[bool] = True
+
+    standard: Optional[bool] = True
+    instrumental: Optional[bool] = True
+    chanting: Optional[bool] = True
+    character: Optional[bool] = True
+
+
 class artist(BaseModel):
     id: int
     names: List[str]
@@ -213,35 +264,125 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def load_database():
+    # The first snapshot is loaded before serving, later swaps are reloaded in the background
+    sql_calls.get_database_snapshot()
+
+
+# Identical searches running at the same time share one computation, keyed by their canonical form
+searches_in_flight = {}
+search_metrics = {
+    "computed_searches": 0,
+    "coalesced_searches": 0,
+    "slow_lane_searches": 0,
+    "rejected_searches": 0,
+}
+
+# Searches run in a lane chosen by their estimated cost so expensive ones can't starve cheap ones
+# a lane answers 503 once max_admitted searches are running or waiting in it
+search_lanes = {
+    "fast": {"executor": ThreadPoolExecutor(8), "max_admitted": 64, "admitted": 0},
+    "slow": {"executor": ThreadPoolExecutor(2), "max_admitted": 8, "admitted": 0},
+}
+# Seconds, sent in the Retry-After header of the 503
+SEARCH_RETRY_AFTER = 5
+
+
+def get_search_key(*search_args):
+    """
+    Canonical form of the arguments of a search, filters are compared field by field
+    """
+
+    return json.dumps(
+        [arg.dict() if isinstance(arg, BaseModel) else arg for arg in search_args],
+        sort_keys=True,
+    )
+
+
+def get_search_lane(query):
+    """
+    Lane of a search from its estimated cost
+    """
+
+    cost = get_search_result.estimate_search_cost(
+        sql_calls.get_database_snapshot(),
+        query.anime_search_filter,
+        query.song_name_search_filter,
+        query.artist_search_filter,
+        query.composer_search_filter,
+    )
+
+    return "slow" if cost >= get_search_result.SLOW_SEARCH_COST else "fast"
+
+
+async def run_single_flight(key, lane_name, function, *args):
+    """
+    Run the function in the lane executor, or wait for the result of the identical call already running
+    """
+
+    if key in searches_in_flight:
+        search_metrics["coalesced_searches"] += 1
+        return await asyncio.shield(searches_in_flight[key])
+
+    lane = search_lanes[lane_name]
+    if lane["admitted"] >= lane["max_admitted"]:
+        search_metrics["rejected_searches"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Too many searches running, please retry later",
+            headers={"Retry-After": str(SEARCH_RETRY_AFTER)},
+        )
+
+    search_metrics["computed_searches"] += 1
+    if lane_name == "slow":
+        search_metrics["slow_lane_searches"] += 1
+
+    lane["admitted"] += 1
+    future = asyncio.get_running_loop().run_in_executor(
+        lane["executor"], function, *args
+    )
+    searches_in_flight[key] = future
+
+    # Done even if the first caller went away, the others still get the result
+    def release(_):
+        searches_in_flight.pop(key, None)
+        lane["admitted"] -= 1
+
+    future.add_done_callback(release)
+
+    return await asyncio.shield(future)
+
+
 def format_artist_ids(artist_database, artist_id, artist_line_up=-1):
-    artist = artist_database[str(artist_id)]
+    artist = artist_database[artist_id]
 
     formatted_artist = {
         "id": artist_id,
-        "names": artist["names"],
+        "names": artist.names,
     }
 
     if artist_line_up != -1:
         formatted_artist["line_up_id"] = artist_line_up
 
-    if artist["groups"]:
+    if artist.groups:
         formatted_group_list = []
-        for group_id, group_line_up_id in artist["groups"]:
+        for group_id, group_line_up_id in artist.groups:
             current_group = {
                 "id": group_id,
-                "names": artist_database[str(group_id)]["names"],
+                "names": artist_database[group_id].names,
             }
             if group_line_up_id != -1:
                 current_group["line_up_id"] = group_line_up_id
             formatted_group_list.append(current_group)
         formatted_artist["groups"] = formatted_group_list
 
-    if artist_line_up != -1 and artist["members"]:
+    if artist_line_up != -1 and artist.line_ups:
         formatted_member_list = []
-        for member_id, member_line_up_id in artist["members"][artist_line_up]:
+        for member_id, member_line_up_id in artist.line_ups[artist_line_up].members:
             current_member = {
                 "id": member_id,
-                "names": artist_database[str(member_id)]["names"],
+                "names": artist_database[member_id].names,
             }
             if member_line_up_id:
                 current_member["line_up_id"] = member_line_up_id
@@ -254,14 +395,14 @@ def format_artist_ids(artist_database, artist_id, artist_line_up=-1):
 def format_composer_ids(artist_database, composer_id):
     composer = {"id": composer_id}
 
-    composer["names"] = artist_database[str(composer_id)]["names"]
+    composer["names"] = artist_database[composer_id].names
 
     return composer
 
 
 def format_arranger_ids(artist_database, arranger_id):
     arranger = {"id": arranger_id}
-    arranger["names"] = artist_database[str(arranger_id)]["names"]
+    arranger["names"] = artist_database[arranger_id].names
 
     return arranger
 
@@ -304,7 +445,7 @@ async def search_request(query: Search_Request):
     if not authorized_song_categories:
         return []
 
-    song_list = get_search_result.get_search_results(
+    search_args = [
         query.anime_search_filter,
         query.song_name_search_filter,
         query.artist_search_filter,
@@ -315,6 +456,24 @@ async def search_request(query: Search_Request):
         authorized_type,
         authorized_broadcasts,
         authorized_song_categories,
+        query.sort_by_relevance,
+    ]
+
+    search_key = get_search_key(*search_args)
+
+    # Coalesced searches are already admitted, no need to estimate them
+    # the estimate runs SQL queries, keep it off the event loop
+    lane_name = "fast"
+    if search_key not in searches_in_flight:
+        lane_name = await asyncio.get_running_loop().run_in_executor(
+            None, get_search_lane, query
+        )
+
+    song_list = await run_single_flight(
+        search_key,
+        lane_name,
+        get_search_result.get_search_results,
+        *search_args,
     )
 
     return song_list
@@ -322,19 +481,64 @@ async def search_request(query: Search_Request):
 
 @app.post("/api/get_50_random_songs", response_model=List[Song_Entry])
 async def get_50_random_songs():
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
 
-    songIds = [randrange(28000) for i in range(50)]
+    song_list = get_search_result.get_random_song_list(
+        50,
+        None,
+        [1, 2, 3],
+        ["Normal", "Dub", "Rebroadcast"],
+        ["Standard", "No Category", "Instrumental", "Chanting", "Character"],
+    )
 
-    artist_database = sql_calls.extract_artist_database()
+    return song_list
 
-    # Extract every song from song IDs
-    get_songs_from_songs_ids = (
-        f"SELECT * from songsFull WHERE songId IN ({','.join('?'*len(songIds))})"
-    )
-    songs = sql_calls.run_sql_command(cursor, get_songs_from_songs_ids, songIds)
 
-    song_list = [utils.format_song(artist_database, song) for song in songs]
+@app.post("/api/random_songs_request", response_model=List[Song_Entry])
+async def random_songs_request(query: Random_Songs_Request):
+
+    authorized_type = []
+    if query.opening_filter:
+        authorized_type.append(1)
+    if query.ending_filter:
+        authorized_type.append(2)
+    if query.insert_filter:
+        authorized_type.append(3)
+
+    authorized_broadcasts = []
+    if query.normal_broadcast:
+        authorized_broadcasts.append("Normal")
+    if query.dub:
+        authorized_broadcasts.append("Dub")
+    if query.rebroadcast:
+        authorized_broadcasts.append("Rebroadcast")
+
+    authorized_song_categories = []
+    if query.standard:
+        authorized_song_categories.append("Standard")
+        authorized_song_categories.append("No Category")
+    if query.instrumental:
+        authorized_song_categories.append("Instrumental")
+    if query.chanting:
+        authorized_song_categories.append("Chanting")
+    if query.character:
+        authorized_song_categories.append("Character")
+
+    if not authorized_type:
+        return []
+
+    if not authorized_broadcasts:
+        return []
+
+    if not authorized_song_categories:
+        return []
+
+    song_list = get_search_result.get_random_song_list(
+        query.nb_songs,
+        query.seed,
+        authorized_type,
+        authorized_broadcasts,
+        authorized_song_categories,
+    )
 
     return song_list
 
@@ -537,13 +741,80 @@ async def malIDs_request(query: malIds_Search_Request):
     return song_list
 
 
+@app.post("/api/external_ids_request", response_model=List[Song_Entry])
+async def external_ids_request(query: External_Ids_Search_Request):
+
+    authorized_type = []
+    if query.opening_filter:
+        authorized_type.append(1)
+    if query.ending_filter:
+        authorized_type.append(2)
+    if query.insert_filter:
+        authorized_type.append(3)
+
+    authorized_broadcasts = []
+    if query.normal_broadcast:
+        authorized_broadcasts.append("Normal")
+    if query.dub:
+        authorized_broadcasts.append("Dub")
+    if query.rebroadcast:
+        authorized_broadcasts.append("Rebroadcast")
+
+    authorized_song_categories = []
+    if query.standard:
+        authorized_song_categories.append("Standard")
+        authorized_song_categories.append("No Category")
+    if query.instrumental:
+        authorized_song_categories.append("Instrumental")
+    if query.chanting:
+        authorized_song_categories.append("Chanting")
+    if query.character:
+        authorized_song_categories.append("Character")
+
+    if not authorized_type:
+        return []
+
+    if not authorized_broadcasts:
+        return []
+
+    if not authorized_song_categories:
+        return []
+
+    song_list = get_search_result.get_external_ids_song_list(
+        {
+            "malId": query.malIds,
+            "anidbId": query.anidbIds,
+            "anilistId": query.anilistIds,
+            "kitsuId": query.kitsuIds,
+        },
+        query.ignore_duplicate,
+        authorized_type,
+        authorized_broadcasts,
+        authorized_song_categories,
+    )
+
+    return song_list
+
+
+@app.get("/api/search_metrics")
+async def get_search_metrics():
+    return {
+        **search_metrics,
+        "searches_in_flight": len(searches_in_flight),
+        **{
+            f"{lane_name}_lane_admitted": lane["admitted"]
+            for lane_name, lane in search_lanes.items()
+        },
+    }
+
+
 # api point that returns every possible songartist string for autocompletion
 @app.get("/api/artist_autocomplete")
 async def artist_autocomplete(
     search: Optional[str] = None,
     count: Optional[int] = 99999,
 ):
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
+    cursor = sql_calls.get_database_snapshot().cursor()
 
     # search is not case sensitive and can be partial
     if search:
@@ -572,7 +843,7 @@ async def song_name_autocomplete(
     search: Optional[str] = None,
     count: Optional[int] = 99999,
 ):
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
+    cursor = sql_calls.get_database_snapshot().cursor()
 
     # search is not case sensitive and can be partial
 
@@ -604,7 +875,7 @@ async def song_name_autocomplete(
 async def anime_name_autocomplete(
     songName: Optional[str] = None, songArtist: Optional[str] = None
 ):
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
+    cursor = sql_calls.get_database_snapshot().cursor()
 
     if songName and songArtist:
         get_all_anime_names = "SELECT DISTINCT animeJPName, animeENName from songsAnimes WHERE romajiSongName = ? AND romajiSongArtist = ?"
@@ -656,12 +927,15 @@ async def filter_season(season: str):
     if len(year) != 4:
         return f"{year} is an invalid year, please use the format 'Season Year'. Example : 'Winter 2021'"
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
+    snapshot = sql_calls.get_database_snapshot()
 
-    get_all_songs = "SELECT * from songsFull WHERE animeVintage LIKE ?"
-    songs = sql_calls.run_sql_command(cursor, get_all_songs, [f"%{season}%"])
+    get_all_songs = "SELECT songId from songsFull WHERE animeVintage LIKE ?"
+    songs = sql_calls.get_songs_from_songIds(
+        snapshot.song_database,
+        sql_calls.run_sql_command(snapshot.cursor(), get_all_songs, [f"%{season}%"]),
+    )
 
-    artist_database = sql_calls.extract_artist_database()
+    artist_database = snapshot.artist_database
 
     song_list = [utils.format_song(artist_database, song) for song in songs]
 
@@ -1,14 +1,39 @@
-import sqlite3, re
+import sqlite3, re, sys, threading
 from pathlib import Path
-from functools import lru_cache
+from array import array
+from heapq import merge
+from itertools import chain, islice
 import timeit
+import fuzzy_index
+import utils
 
 local_path = Path("data")
 database_path = local_path / Path("Enhanced-AMQ-Database.db")
 
+# Snapshot every request reads from, replaced as a whole when the database is swapped
+database_snapshot = None
+# Set while the snapshot of a swapped database is loaded in the background
+snapshot_loading = False
+snapshot_lock = threading.Lock()
 
-@lru_cache(maxsize=None)
-def extract_song_database():
+# animes columns of the external IDs anime lists are imported with
+EXTERNAL_ID_COLUMNS = ["malId", "anidbId", "anilistId", "kitsuId"]
+
+# songsFull columns holding comma-joined IDs: artists, composers, arrangers and their line ups
+SONG_ID_COLUMNS = [23, 24, 27, 28, 31, 32]
+
+# songsFull columns of the IDs and line ups of every role of the song posting lists
+SONG_POSTING_ROLES = {"artist": (23, 24), "composer": (27, 28), "arranger": (31, 32)}
+
+# songsFull columns of the names the relevance of the songs is computed on, and of their alternative anime names
+SONG_NAME_COLUMNS = [5, 6, 7, 19, 20, 21, 22, 25, 26, 29, 30]
+SONG_ALT_NAME_COLUMNS = [8, 9]
+
+# Songs kept per role by composer searches, as the composer and arranger queries used to be limited
+MAX_COMPOSING_TEAM_SONGS = 500
+
+
+def extract_song_database(cursor):
     """
     Extract the song database
     """
@@ -17,29 +42,93 @@ def extract_song_database():
     SELECT * FROM songsFull;
     """
 
-    cursor = connect_to_database(database_path)
-
     song_database = {}
     for song in run_sql_command(cursor, command):
-        song_database[song[13]] = song
+        song_database[song[13]] = parse_song_ids(song)
 
     return song_database
 
 
-@lru_cache(maxsize=None)
-def extract_anime_database():
+def parse_song_ids(song):
     """
-    Extract the song database
+    Decode the comma-joined ID columns of a songsFull row into tuples of int
+    Done once when the songs are loaded so the searches never parse them
     """
 
-    command = """
-    SELECT * FROM songsFull;
+    song = list(song)
+    for column in SONG_ID_COLUMNS:
+        song[column] = (
+            tuple(int(id) for id in song[column].split(",")) if song[column] else ()
+        )
+    return tuple(song)
+
+
+def get_songs_from_songIds(song_database, songIds):
+    """
+    Return the loaded songs of the songId rows returned by a query
     """
 
-    cursor = connect_to_database(database_path)
+    if songIds is None:
+        return None
+
+    return [song_database[songId[0]] for songId in songIds]
+
+
+def get_song_broadcast(song):
+    """
+    Return the broadcast bucket of a song, matching the filtering rules of the search
+    (a dubbed rebroadcast is only shown when rebroadcasts are authorized)
+    """
+
+    if song[35]:
+        return "Rebroadcast"
+    if song[34]:
+        return "Dub"
+    return "Normal"
+
+
+def extract_song_name_blob(song_database):
+    """
+    Extract the lowered song names joined by newlines, the start offset of every line and its songId
+    so a song name regex runs once over the whole blob instead of once per song
+    """
+
+    names = []
+    offsets = []
+    songIds = []
+    offset = 0
+    for songId, song in song_database.items():
+        name = song[20].lower().replace("\n", " ")
+        names.append(name)
+        offsets.append(offset)
+        songIds.append(songId)
+        offset += len(name) + 1
+
+    return "\n".join(names), offsets, songIds
+
+
+def extract_song_buckets(song_database):
+    """
+    Extract the song IDs grouped by (songType, broadcast, songCategory)
+    so random draws only touch the buckets matching the filters
+    """
+
+    song_buckets = {}
+    for songId in sorted(song_database):
+        song = song_database[songId]
+        key = (song[16], get_song_broadcast(song), song[18])
+        song_buckets.setdefault(key, []).append(songId)
+
+    return song_buckets
+
+
+def extract_anime_database(song_database):
+    """
+    Extract the song database
+    """
 
     anime_database = {}
-    for song in run_sql_command(cursor, command):
+    for song in song_database.values():
         if song[0] not in anime_database:
             anime_database[song[0]] = {
                 "animeJPName": song[6],
@@ -55,90 +144,224 @@ def extract_anime_database():
     return anime_database
 
 
-@lru_cache(maxsize=None)
-def extract_artist_database():
+def extract_external_id_maps(cursor):
     """
-    Extract the artist database
+    Extract the maps from every external ID column to the annIds using it
+    ie. {"malId": {malId: [annId, ...]}, "anidbId": {...}, ...}
     """
 
-    cursor = connect_to_database(database_path)
+    command = (
+        f"SELECT annId, {', '.join(EXTERNAL_ID_COLUMNS)} FROM animes ORDER BY annId"
+    )
 
-    extract_basic_info = """
-    SELECT id, romaji_names, disambiguation, type FROM artistsNames
-    """
+    external_id_maps = {column: {} for column in EXTERNAL_ID_COLUMNS}
+    for anime in run_sql_command(cursor, command):
+        for column, external_id in zip(EXTERNAL_ID_COLUMNS, anime[1:]):
+            if external_id is not None:
+                external_id_maps[column].setdefault(external_id, []).append(anime[0])
+
+    return external_id_maps
 
-    basic_info = run_sql_command(cursor, extract_basic_info)
 
-    extract_artist_groups = """
-    SELECT id, groups, groups_line_up FROM artistsGroups
+class Artist:
+    """
+    Record of the artist database, names, groups and line ups are tuples once loaded
+    groups are (group_id, group_line_up_id) and line_ups are indexed by line up ID
     """
 
-    artist_groups = run_sql_command(cursor, extract_artist_groups)
+    __slots__ = ["names", "groups", "line_ups", "disambiguation", "type"]
+
+    def __init__(self, disambiguation, type):
+        self.names = []
+        self.groups = []
+        self.line_ups = []
+        self.disambiguation = disambiguation
+        self.type = type
+
 
-    extract_line_up_members = """
-    SELECT artist_id, line_up_id, line_up_type, members, members_line_up FROM lineUpsMembers
+class Line_Up:
     """
+    Line up of a group, members are (member_id, member_line_up_id)
+    """
+
+    __slots__ = ["line_up_type", "members"]
+
+    def __init__(self, line_up_type):
+        self.line_up_type = line_up_type
+        self.members = []
 
-    line_ups_members = run_sql_command(cursor, extract_line_up_members)
 
-    if len(basic_info) != len(artist_groups):
-        print("ERROR EXTRACTING ARTIST DATABASE")
-        return {}
+def extract_artist_database(cursor):
+    """
+    Extract the artist database keyed by artist ID, every table is read once and joined by ID
+    Inconsistent rows are skipped with a message instead of failing the whole database
+    """
 
     artist_database = {}
-    for info, groups in zip(basic_info, artist_groups):
-        if info[0] != groups[0]:
-            print("ERROR EXTRACTING ARTIST DATABASE")
-            return {}
-
-        artist_database[str(info[0])] = {
-            "names": info[1].split("\$"),
-            "groups": (
-                [
-                    [group, int(line_up)]
-                    for group, line_up in zip(
-                        groups[1].split(","), groups[2].split(",")
-                    )
-                ]
-                if groups[1]
-                else []
-            ),
-            "line_ups": [],
-            "disambiguation": info[2],
-            "type": info[3],
-        }
+    for id, disambiguation, type in run_sql_command(
+        cursor, "SELECT id, disambiguation, type FROM artists ORDER BY id"
+    ):
+        artist_database[id] = Artist(disambiguation, type)
 
-    for line_up_members in line_ups_members:
+    for artist_id, romaji_name in run_sql_command(
+        cursor,
+        "SELECT artist_id, romaji_name FROM link_artist_name ORDER BY artist_id, inserted_order",
+    ):
+        if artist_id not in artist_database:
+            print(
+                f"ERROR EXTRACTING ARTIST DATABASE: name '{romaji_name}' of unknown artist {artist_id}"
+            )
+            continue
+        # The same names are shared by a lot of artists and songs
+        artist_database[artist_id].names.append(sys.intern(romaji_name))
+
+    for artist_id, line_up_id, line_up_type in run_sql_command(
+        cursor,
+        "SELECT artist_id, line_up_id, line_up_type FROM line_ups ORDER BY artist_id, line_up_id",
+    ):
+        if artist_id not in artist_database:
+            print(
+                f"ERROR EXTRACTING ARTIST DATABASE: line up {line_up_id} of unknown artist {artist_id}"
+            )
+            continue
+
+        line_ups = artist_database[artist_id].line_ups
+        # Line ups are accessed by index
+        if line_up_id != len(line_ups):
+            print(
+                f"ERROR EXTRACTING ARTIST DATABASE: line up {line_up_id} of artist {artist_id} should be line up {len(line_ups)}"
+            )
+            continue
+        line_ups.append(Line_Up(line_up_type))
+
+    for group_id, group_line_up_id, member_id, member_line_up_id in run_sql_command(
+        cursor,
+        "SELECT group_id, group_line_up_id, member_id, member_line_up_id FROM link_artist_line_up ORDER BY group_id, group_line_up_id, member_id, member_line_up_id",
+    ):
+        if member_id not in artist_database:
+            print(
+                f"ERROR EXTRACTING ARTIST DATABASE: unknown member {member_id} in line up {group_line_up_id} of artist {group_id}"
+            )
+            continue
+        if (
+            group_id not in artist_database
+            or len(artist_database[group_id].line_ups) <= group_line_up_id
+        ):
+            print(
+                f"ERROR EXTRACTING ARTIST DATABASE: member {member_id} in unknown line up {group_line_up_id} of artist {group_id}"
+            )
+            continue
 
-        artist = artist_database[str(line_up_members[0])]
+        artist_database[group_id].line_ups[group_line_up_id].members.append(
+            (member_id, member_line_up_id)
+        )
 
-        # retrieve info from the artist
-        for info in basic_info:
-            if info[0] == line_up_members[0]:
-                break
+    # The groups of an artist are listed in the same order as its memberships
+    for member_id, group_id, group_line_up_id in run_sql_command(
+        cursor,
+        "SELECT member_id, group_id, group_line_up_id FROM link_artist_line_up ORDER BY member_id, group_id, group_line_up_id",
+    ):
+        if member_id in artist_database and group_id in artist_database:
+            artist_database[member_id].groups.append((group_id, group_line_up_id))
 
-        if info[0] != line_up_members[0]:
-            print(f"ERROR EXTRACTING ARTIST DATABASE on {line_up_members[0]}")
-            return {}
+    for artist in artist_database.values():
+        artist.names = tuple(artist.names)
+        artist.groups = tuple(artist.groups)
+        for line_up in artist.line_ups:
+            line_up.members = tuple(line_up.members)
+        artist.line_ups = tuple(artist.line_ups)
 
-        if line_up_members[1] != len(artist["line_ups"]):
-            print(f"ERROR EXTRACTING ARTIST DATABASE on {line_up_members[0]}")
-            return {}
+    return artist_database
 
-        current_lu = []
-        for member_id, member_line_up_id in zip(
-            line_up_members[3].split(","), line_up_members[4].split(",")
-        ):
-            current_lu.append([member_id, int(member_line_up_id)])
 
-        artist["line_ups"].append(
-            {
-                "line_up_type": line_up_members[2],
-                "members": current_lu,
-            }
+def extract_song_postings(song_database):
+    """
+    Extract the posting lists from every artist to its songs for every role (artist, composer, arranger)
+    Return {role: {artist_id: song IDs}} and {role: {(artist_id, line_up_id): song IDs}}
+    Song IDs are sorted int arrays with one entry per credit, like the link tables they replace
+    """
+
+    postings = {role: {} for role in SONG_POSTING_ROLES}
+    line_up_postings = {role: {} for role in SONG_POSTING_ROLES}
+
+    for songId in sorted(song_database):
+        song = song_database[songId]
+        for role, (ids_column, line_ups_column) in SONG_POSTING_ROLES.items():
+            for artist_id, line_up in zip(song[ids_column], song[line_ups_column]):
+                postings[role].setdefault(artist_id, array("l")).append(songId)
+                line_up_postings[role].setdefault(
+                    (artist_id, line_up), array("l")
+                ).append(songId)
+
+    return postings, line_up_postings
+
+
+def extract_songs_members_flat(song_database, artist_database):
+    """
+    Extract the flattened artists, composers and arrangers of every song (groups replaced by their line up members)
+    each as (members, member set) so the artist requirements of a search only intersect sets
+    """
+
+    songs_members_flat = {}
+    for songId, song in song_database.items():
+        songs_members_flat[songId] = tuple(
+            (members, frozenset(members))
+            for members in (
+                tuple(
+                    utils.get_member_list_flat(
+                        artist_database, list(zip(song[ids], song[line_ups]))
+                    )
+                )
+                for ids, line_ups in [(23, 24), (27, 28), (31, 32)]
+            )
         )
 
-    return artist_database
+    return songs_members_flat
+
+
+def extract_fuzzy_index(snapshot, name_type):
+    """
+    Extract the typo tolerant index of the anime, song or artist names
+    """
+
+    if name_type == "anime":
+        names = (
+            (annId, name)
+            for annId, anime in snapshot.anime_database.items()
+            for name in [anime["animeJPName"], anime["animeENName"]]
+            + (anime["animeAltNames"].split("\\$") if anime["animeAltNames"] else [])
+            if name
+        )
+    elif name_type == "song":
+        names = ((songId, song[20]) for songId, song in snapshot.song_database.items())
+    elif name_type == "artist":
+        names = (
+            (artist_id, name)
+            for artist_id, artist in snapshot.artist_database.items()
+            for name in artist.names
+        )
+    else:
+        raise ValueError(f"Unknown name type: {name_type}")
+
+    return fuzzy_index.Fuzzy_Index(names)
+
+
+def extract_name_keys(song_database, artist_database):
+    """
+    Extract the folded keys (utils.get_name_keys) of every name the relevance of the songs is computed on
+    so sorting by relevance never folds a name again
+    """
+
+    names = set()
+    for song in song_database.values():
+        names.update(song[column] for column in SONG_NAME_COLUMNS)
+        for column in SONG_ALT_NAME_COLUMNS:
+            if song[column]:
+                names.update(song[column].split("\\$"))
+    for artist in artist_database.values():
+        names.update(artist.names)
+
+    return {name: tuple(utils.get_name_keys(name)) for name in names if name}
 
 
 def run_sql_command(cursor, sql_command, data=None):
@@ -184,13 +407,23 @@ def regexp(expr, item):
         pass
 
 
-def connect_to_database(database_path):
+def get_database_version(cursor):
+    """
+    Version stamp (PRAGMA user_version) of the database, convert_to_SQL.py changes it with every build
+    """
+
+    return cursor.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def connect_to_database(database_path, check_same_thread=True):
     """
     Connect to the database and return the connection's cursor
     """
 
     try:
-        sqliteConnection = sqlite3.connect(database_path)
+        sqliteConnection = sqlite3.connect(
+            database_path, check_same_thread=check_same_thread
+        )
         sqliteConnection.create_function("REGEXP", 2, regexp)
         cursor = sqliteConnection.cursor()
         return cursor
@@ -199,8 +432,83 @@ def connect_to_database(database_path):
         exit(0)
 
 
+class Database_Snapshot:
+    """
+    Every extract of one version of the database, loaded together and never modified afterwards
+    A request takes the current snapshot once and reads everything from it,
+    so a database swap in the middle of a search can't mix the songs of two versions
+    """
+
+    def __init__(self, database_path):
+        # The connection keeps reading the file it opened after convert_to_SQL.py swaps a new one in
+        # and is shared by the search threads (sqlite3 is built serialized, threadsafety 3)
+        self.connection = connect_to_database(
+            database_path, check_same_thread=False
+        ).connection
+        cursor = self.connection.cursor()
+
+        self.version = get_database_version(cursor)
+        self.song_database = extract_song_database(cursor)
+        self.song_name_blob = extract_song_name_blob(self.song_database)
+        self.song_buckets = extract_song_buckets(self.song_database)
+        self.anime_database = extract_anime_database(self.song_database)
+        self.artist_database = extract_artist_database(cursor)
+        self.external_id_maps = extract_external_id_maps(cursor)
+        self.song_postings = extract_song_postings(self.song_database)
+        self.songs_members_flat = extract_songs_members_flat(
+            self.song_database, self.artist_database
+        )
+        self.name_keys = extract_name_keys(self.song_database, self.artist_database)
+        # Built with the snapshot so no fuzzy search has to build one
+        self.fuzzy_indexes = {
+            name_type: extract_fuzzy_index(self, name_type)
+            for name_type in ["anime", "song", "artist"]
+        }
+
+    def cursor(self):
+        return self.connection.cursor()
+
+
+def load_database_snapshot():
+    """
+    Load the snapshot of the swapped database and replace the current one once it is ready
+    """
+
+    global database_snapshot, snapshot_loading
+
+    try:
+        snapshot = Database_Snapshot(database_path)
+        with snapshot_lock:
+            database_snapshot = snapshot
+        print(f"Database version {snapshot.version} loaded")
+    finally:
+        with snapshot_lock:
+            snapshot_loading = False
+
+
+def get_database_snapshot():
+    """
+    Return the snapshot of the current database
+    When convert_to_SQL.py swapped the file, the new snapshot is loaded in the background
+    and the requests keep being served from the previous one until it is ready
+    """
+
+    global database_snapshot, snapshot_loading
+
+    version = get_database_version(connect_to_database(database_path))
+    with snapshot_lock:
+        # Nothing to serve yet, the first snapshot is loaded right away
+        if database_snapshot is None:
+            database_snapshot = Database_Snapshot(database_path)
+        elif database_snapshot.version != version and not snapshot_loading:
+            print(f"Database swapped to version {version}, reloading")
+            snapshot_loading = True
+            threading.Thread(target=load_database_snapshot, daemon=True).start()
+        return database_snapshot
+
+
 def get_songs_list_from_annIds(
-    cursor,
+    snapshot,
     annIds,
     authorized_types,
     authorized_broadcasts,
@@ -215,16 +523,19 @@ def get_songs_list_from_annIds(
     if "Normal" not in authorized_broadcasts:
         broadcast_filter += " AND isDub == 1 AND isRebroadcast == 1"
 
-    get_songs_from_annId = f"SELECT * from songsFull WHERE songType IN ({','.join('?'*len(authorized_types))}) AND annId IN ({','.join('?'*len(annIds))}) {broadcast_filter} AND songCategory IN ({','.join('?'*len(authorized_song_categories))}) LIMIT 500"
-    return run_sql_command(
-        cursor,
-        get_songs_from_annId,
-        authorized_types + annIds + authorized_song_categories,
+    get_songs_from_annId = f"SELECT songId from songsFull WHERE songType IN ({','.join('?'*len(authorized_types))}) AND annId IN ({','.join('?'*len(annIds))}) {broadcast_filter} AND songCategory IN ({','.join('?'*len(authorized_song_categories))}) LIMIT 500"
+    return get_songs_from_songIds(
+        snapshot.song_database,
+        run_sql_command(
+            snapshot.cursor(),
+            get_songs_from_annId,
+            authorized_types + annIds + authorized_song_categories,
+        ),
     )
 
 
 def get_songs_list_from_malIds(
-    cursor,
+    snapshot,
     malIds,
     authorized_types,
     authorized_broadcasts,
@@ -239,18 +550,81 @@ def get_songs_list_from_malIds(
     if "Normal" not in authorized_broadcasts:
         broadcast_filter += " AND isDub == 1 AND isRebroadcast == 1"
 
-    get_songs_from_malIds = f"SELECT * from songsFull WHERE songType IN ({','.join('?'*len(authorized_types))}) AND malId IN ({','.join('?'*len(malIds))}) {broadcast_filter} AND songCategory IN ({','.join('?'*len(authorized_song_categories))})"
-    return run_sql_command(
+    get_songs_from_malIds = f"SELECT songId from songsFull WHERE songType IN ({','.join('?'*len(authorized_types))}) AND malId IN ({','.join('?'*len(malIds))}) {broadcast_filter} AND songCategory IN ({','.join('?'*len(authorized_song_categories))})"
+    return get_songs_from_songIds(
+        snapshot.song_database,
+        run_sql_command(
+            snapshot.cursor(),
+            get_songs_from_malIds,
+            authorized_types + malIds + authorized_song_categories,
+        ),
+    )
+
+
+def get_name_search_patterns(folded_searches, partial_match):
+    """
+    LIKE patterns for the full-text name tables, the trigram index is used for any pattern of 3 characters or more
+    """
+
+    if partial_match:
+        return [f"%{search}%" for search in folded_searches]
+    return folded_searches
+
+
+def get_ids_from_names(cursor, fts_table, id_column, folded_searches, partial_match):
+    """
+    Ids matching one of the searches in a full-text name table
+    """
+
+    if not folded_searches:
+        return []
+
+    # One LIKE per subquery, the FTS index is not used for LIKEs combined with OR
+    name_search = " UNION ".join(
+        [f"SELECT {id_column} FROM {fts_table} WHERE name LIKE ?"]
+        * len(folded_searches)
+    )
+    ids = run_sql_command(
+        cursor,
+        name_search,
+        get_name_search_patterns(folded_searches, partial_match),
+    )
+    return [id[0] for id in ids] if ids else []
+
+
+def get_name_match_count(cursor, fts_table, id_column, folded_searches, partial_match):
+    """
+    Number of ids matching one of the searches in a full-text name table, used to order the filters of a search
+    """
+
+    if not folded_searches:
+        return 0
+
+    # One LIKE per subquery, the FTS index is not used for LIKEs combined with OR
+    name_search = " UNION ".join(
+        [f"SELECT {id_column} FROM {fts_table} WHERE name LIKE ?"]
+        * len(folded_searches)
+    )
+    get_name_match_count = f"SELECT COUNT(*) from ({name_search})"
+    count = run_sql_command(
         cursor,
-        get_songs_from_malIds,
-        authorized_types + malIds + authorized_song_categories,
+        get_name_match_count,
+        get_name_search_patterns(folded_searches, partial_match),
     )
+    return count[0][0] if count else 0
 
 
-def get_song_list_from_songArtist(
-    cursor, regex, authorized_types, authorized_broadcasts, authorized_song_categories
+def get_song_list_from_songArtist_name(
+    snapshot,
+    folded_searches,
+    partial_match,
+    authorized_types,
+    authorized_broadcasts,
+    authorized_song_categories,
 ):
-    # TODO Indexes on lower ?
+
+    if not folded_searches:
+        return []
 
     broadcast_filter = ""
     if "Dub" not in authorized_broadcasts:
@@ -260,66 +634,107 @@ def get_song_list_from_songArtist(
     if "Normal" not in authorized_broadcasts:
         broadcast_filter += " AND isDub == 1 AND isRebroadcast == 1"
 
-    get_song_list_from_songArtist = f"SELECT * from songsFull WHERE songType IN ({','.join('?'*len(authorized_types))}) {broadcast_filter} AND songCategory IN ({','.join('?'*len(authorized_song_categories))}) AND lower(romajiSongArtist) REGEXP ? LIMIT 500"
-    return run_sql_command(
-        cursor,
-        get_song_list_from_songArtist,
-        authorized_types + authorized_song_categories + [regex],
+    # One LIKE per subquery, the FTS index is not used for LIKEs combined with OR
+    name_search = " UNION ".join(
+        ["SELECT song_id FROM song_artists_fts WHERE name LIKE ?"]
+        * len(folded_searches)
     )
 
+    get_song_list_from_songArtist = f"SELECT songId from songsFull WHERE songId IN ({name_search}) AND songType IN ({','.join('?'*len(authorized_types))}) {broadcast_filter} AND songCategory IN ({','.join('?'*len(authorized_song_categories))}) LIMIT 500"
+    return get_songs_from_songIds(
+        snapshot.song_database,
+        run_sql_command(
+            snapshot.cursor(),
+            get_song_list_from_songArtist,
+            get_name_search_patterns(folded_searches, partial_match)
+            + authorized_types
+            + authorized_song_categories,
+        ),
+    )
 
-def get_songs_ids_from_artist_ids(cursor, artist_ids):
-    get_songs_ids_from_artist_ids = f"SELECT song_id from link_song_artist WHERE artist_id IN ({','.join('?'*len(artist_ids))})"
-    return [
-        id[0]
-        for id in run_sql_command(
-            cursor, get_songs_ids_from_artist_ids, [str(id) for id in artist_ids]
-        )
-    ]
 
+def get_songs_ids_from_artist_ids(snapshot, artist_ids):
+    """
+    Song IDs performed by the artists, sorted with one entry per credit
+    """
 
-def get_songs_ids_from_composing_team_ids(cursor, composer_ids, arrangement):
-    # TODO FIND A BETTER WAY WITH VIEW
-    get_songs_ids_from_composer_ids = f"SELECT song_id from link_song_composer WHERE composer_id IN ({','.join('?'*len(composer_ids))}) LIMIT 500"
-    songIds = set()
-    for song_id in run_sql_command(
-        cursor, get_songs_ids_from_composer_ids, composer_ids
-    ):
-        songIds.add(song_id[0])
+    postings = snapshot.song_postings[0]["artist"]
+    return list(merge(*(postings.get(artist_id, ()) for artist_id in set(artist_ids))))
 
-    if arrangement:
-        get_songs_ids_from_arranger_ids = f"SELECT song_id from link_song_arranger WHERE arranger_id IN ({','.join('?'*len(composer_ids))}) LIMIT 500"
-        for song_id in run_sql_command(
-            cursor, get_songs_ids_from_arranger_ids, composer_ids
-        ):
-            songIds.add(song_id[0])
 
-    songIds = list(songIds)
+def get_songs_ids_from_line_ups(snapshot, role, line_ups):
+    """
+    Sorted song IDs where one of the (artist_id, line_up_id) is credited in the role
+    """
+
+    line_up_postings = snapshot.song_postings[1][role]
+    return sorted(
+        {
+            songId
+            for line_up in set(line_ups)
+            for songId in line_up_postings.get(line_up, ())
+        }
+    )
+
+
+def get_songs_ids_from_composing_team_ids(snapshot, composer_ids, arrangement):
+    """
+    Sorted song IDs composed (or arranged) by the composers, limited per role
+    """
+
+    postings = snapshot.song_postings[0]
+    roles = ["composer", "arranger"] if arrangement else ["composer"]
+
+    songIds = set()
+    for role in roles:
+        songIds.update(
+            islice(
+                chain.from_iterable(
+                    postings[role].get(composer_id, ())
+                    for composer_id in sorted(set(composer_ids))
+                ),
+                MAX_COMPOSING_TEAM_SONGS,
+            )
+        )
+
+    return sorted(songIds)
 
-    return songIds
 
+def get_artist_ids_from_names(cursor, folded_searches, partial_match):
+    if not folded_searches:
+        return []
 
-def get_artist_ids_from_regex(cursor, regex):
-    # TODO Index on lower ?
-    get_artist_ids_from_regex = "SELECT artist_id from link_artist_name WHERE lower(romaji_name) REGEXP ? GROUP BY artist_id LIMIT 50"
+    # One LIKE per subquery, the FTS index is not used for LIKEs combined with OR
+    name_search = " UNION ALL ".join(
+        ["SELECT artist_id FROM artist_names_fts WHERE name LIKE ?"]
+        * len(folded_searches)
+    )
+    get_artist_ids_from_names = (
+        f"SELECT artist_id from ({name_search}) GROUP BY artist_id LIMIT 50"
+    )
     artist_ids = [
-        id[0] for id in run_sql_command(cursor, get_artist_ids_from_regex, [regex])
+        id[0]
+        for id in run_sql_command(
+            cursor,
+            get_artist_ids_from_names,
+            get_name_search_patterns(folded_searches, partial_match),
+        )
     ]
     return artist_ids
 
 
-def get_song_list_from_links(cursor, link):
+def get_song_list_from_links(snapshot, link):
     if "catbox.moe" not in link or (".webm" not in link and ".mp3" not in link):
         return []
 
-    link = f".*{link}.*"
+    # Songs are stored with their catbox file name only (ie. "abcdef.webm")
+    catbox_id = link.strip().split("?")[0].split("#")[0].split("/")[-1]
 
-    # TODO Indexes ?
     get_songs_from_link = (
-        f"SELECT * from songsFull WHERE HQ REGEXP ? OR MQ REGEXP ? OR audio REGEXP ?"
+        "SELECT song_id from link_song_catbox WHERE catbox_id = ? ORDER BY song_id"
     )
-    songs = run_sql_command(cursor, get_songs_from_link, [link, link, link])
-    return songs
+    songs = run_sql_command(snapshot.cursor(), get_songs_from_link, [catbox_id])
+    return get_songs_from_songIds(snapshot.song_database, songs)
 
 
 def get_artist_names_from_artist_id(cursor, artist_id):
@@ -1,4 +1,5 @@
 import re
+import unicodedata
 
 ANIME_REGEX_REPLACE_RULES = [
     # Ļ can't lower correctly with sqlite lower function hence why next line is needed
@@ -45,6 +46,201 @@ ANIME_REGEX_REPLACE_RULES = [
     {"input": "s", "replace": "[sς]"},
 ]
 
+# Characters replaced by a regex rule, any other character of a search is matched as is
+REGEX_RULE_CHARACTERS = "".join(
+    sorted({char for rule in ANIME_REGEX_REPLACE_RULES for char in rule["input"]})
+)
+# Shorter fragments are in too many names to reject any before the regex
+MIN_REGEX_LITERAL_LENGTH = 3
+
+# Same equivalences as ANIME_REGEX_REPLACE_RULES, as a folding applied to both names and searches
+# so a plain substring comparison (used by the full-text name tables) matches like the regex
+# Keep both in sync when adding a rule
+NAME_FOLDING_RULES = {
+    "l": "˥ļ",
+    "z": "ź",
+    "o": "ōóòöôøөφο",
+    "u": "ūûúùüǖμ",
+    "ae": "æ",
+    "a": "äãά@âàáạåā∀λ",
+    "c": "č℃ↄ",
+    "e": "əéêёëèē",
+    "n": "ñ",
+    "2": "²₂",
+    "3": "³",
+    "5": "⁵",
+    "i": "íίɪ",
+    "x": "×",
+    "b": "ßβ",
+    "r": "я",
+    "s": "ς",
+}
+
+NAME_FOLDING_TABLE = str.maketrans(
+    {char: base for base, chars in NAME_FOLDING_RULES.items() for char in chars}
+)
+
+# Characters matched by two regex rules (Λ: "a" and "l", Ө: "o" and "0"), names using them are folded both ways
+NAME_FOLDING_ALTERNATIVES = {"λ": "l", "ө": "0"}
+
+NAME_FOLDING_ALTERNATIVE_TABLE = str.maketrans(
+    {
+        **{char: base for base, chars in NAME_FOLDING_RULES.items() for char in chars},
+        **NAME_FOLDING_ALTERNATIVES,
+    }
+)
+
+NAME_FOLDING_COLLAPSE_RULES = [
+    {"input": "ou", "replace": "o"},
+    {"input": "oo", "replace": "o"},
+    {"input": "oh", "replace": "o"},
+    {"input": "wo", "replace": "o"},
+    {"input": "uu", "replace": "u"},
+    {"input": "aa", "replace": "a"},
+    {"input": "ii", "replace": "i"},
+]
+
+
+# Names written in kana or kanji (half-width katakana included)
+JAPANESE_SCRIPT = re.compile(
+    r"[\u3040-\u30ff\u31f0-\u31ff\u3400-\u4dbf\u4e00-\u9fff\uff66-\uff9f]"
+)
+
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+# Hepburn reading of the hiragana, small kana and digraphs are handled by kana_to_romaji
+KANA_ROMAJI = {
+    **dict(zip("あいうえお", ["a", "i", "u", "e", "o"])),
+    **dict(zip("かきくけこ", ["ka", "ki", "ku", "ke", "ko"])),
+    **dict(zip("がぎぐげご", ["ga", "gi", "gu", "ge", "go"])),
+    **dict(zip("さしすせそ", ["sa", "shi", "su", "se", "so"])),
+    **dict(zip("ざじずぜぞ", ["za", "ji", "zu", "ze", "zo"])),
+    **dict(zip("たちつてと", ["ta", "chi", "tsu", "te", "to"])),
+    **dict(zip("だぢづでど", ["da", "ji", "zu", "de", "do"])),
+    **dict(zip("なにぬねの", ["na", "ni", "nu", "ne", "no"])),
+    **dict(zip("はひふへほ", ["ha", "hi", "fu", "he", "ho"])),
+    **dict(zip("ばびぶべぼ", ["ba", "bi", "bu", "be", "bo"])),
+    **dict(zip("ぱぴぷぺぽ", ["pa", "pi", "pu", "pe", "po"])),
+    **dict(zip("まみむめも", ["ma", "mi", "mu", "me", "mo"])),
+    **dict(zip("やゆよ", ["ya", "yu", "yo"])),
+    **dict(zip("らりるれろ", ["ra", "ri", "ru", "re", "ro"])),
+    **dict(zip("わゐゑをんゔゕゖ", ["wa", "i", "e", "wo", "n", "vu", "ka", "ke"])),
+}
+SMALL_KANA_ROMAJI = dict(
+    zip("ぁぃぅぇぉゃゅょゎ", ["a", "i", "u", "e", "o", "ya", "yu", "yo", "wa"])
+)
+
+
+def normalize_kana(name):
+    """
+    Fold the half-width and full-width forms and write the katakana as hiragana
+    """
+
+    return unicodedata.normalize("NFKC", name).translate(KATAKANA_TO_HIRAGANA)
+
+
+def kana_to_romaji(name):
+    """
+    Romaji reading of the kana of a normalized name, any other character (ie. kanji) is kept as is
+    """
+
+    romaji = []
+    double_next = False
+    for char in name:
+        if char in SMALL_KANA_ROMAJI and romaji and romaji[-1][-1:] in "aiueo":
+            # Digraphs (きゃ: kya, しゃ: sha) and extended kana (ふぁ: fa, てぃ: ti)
+            small = SMALL_KANA_ROMAJI[char]
+            previous = romaji[-1][:-1]
+            if small[0] == "y" and previous.endswith(("sh", "ch", "j")):
+                small = small[1:]
+            elif small[0] != "y":
+                previous = previous or "w"
+            romaji[-1] = previous + small
+            continue
+
+        if char == "っ":
+            double_next = True
+            continue
+
+        reading = KANA_ROMAJI.get(char) or SMALL_KANA_ROMAJI.get(char)
+        if reading is None:
+            # The long vowel mark is dropped, folding collapses long vowels anyway
+            reading = "" if char == "ー" else char
+        if double_next and reading[:1] not in ["", "a", "i", "u", "e", "o", "n"]:
+            reading = ("t" if reading.startswith("ch") else reading[0]) + reading
+        double_next = False
+        romaji.append(reading)
+
+    return "".join(romaji)
+
+
+def fold_name(name, collapse=True, folding_table=NAME_FOLDING_TABLE):
+    """
+    Fold a name (or a search) to the form stored in the full-text name tables
+    """
+
+    name = name.lower().translate(folding_table)
+    if collapse:
+        for rule in NAME_FOLDING_COLLAPSE_RULES:
+            name = name.replace(rule["input"], rule["replace"])
+    # Any punctuation is equivalent to a space, like the " " regex rule
+    return re.sub(r"[\W_]+", " ", name).strip()
+
+
+def get_foldings(name):
+    """
+    Folded forms of a name: with the long vowels collapsed (ou, ō and o match each other)
+    and without, so a substring cut by a collapse still matches (ie. "hashi" in "ohashi")
+    """
+
+    folding_tables = [NAME_FOLDING_TABLE]
+    if any(char in NAME_FOLDING_ALTERNATIVES for char in name.lower()):
+        folding_tables.append(NAME_FOLDING_ALTERNATIVE_TABLE)
+
+    return [
+        fold_name(name, collapse, folding_table)
+        for folding_table in folding_tables
+        for collapse in [True, False]
+    ]
+
+
+def get_name_keys(name):
+    """
+    Folded forms a name is stored with in the full-text name tables
+    Names in kana or kanji are stored normalized and with the romaji reading of their kana
+    """
+
+    if not JAPANESE_SCRIPT.search(name):
+        return list(dict.fromkeys(get_foldings(name)))
+
+    name = normalize_kana(name)
+    return list(dict.fromkeys(get_foldings(name) + get_foldings(kana_to_romaji(name))))
+
+
+def is_original_script(search):
+    """
+    Searches written in kana or kanji, the regex rules only apply to romaji so they go through the full-text name tables
+    """
+
+    return bool(JAPANESE_SCRIPT.search(search))
+
+
+def get_folded_searches(og_search, swap_words=False):
+    """
+    Folded equivalent of get_regex_search: the search and its swapped version for two words searches
+    (every name key of them, see get_name_keys)
+    """
+
+    searches = get_name_keys(og_search)
+
+    if swap_words:
+        alt_search = og_search.split(" ")
+        if len(alt_search) == 2:
+            searches += get_name_keys(" ".join([alt_search[1], alt_search[0]]))
+
+    # A search made of punctuation only folds to nothing and would match every name
+    return list(dict.fromkeys(search for search in searches if search))
+
 
 def escapeRegExp(str):
     str = re.escape(str)
@@ -78,6 +274,59 @@ def get_regex_search(og_search, partial_match=True, swap_words=False):
     return search
 
 
+def get_regex_literals(og_search):
+    """
+    Fragments of the search left as is by the regex rules, longest first
+    Every name matching get_regex_search contains all of them, so a substring check rejects most names
+    before the regex is tried (none are returned when they are all too short to reject anything)
+    """
+
+    fragments = re.split(f"[{re.escape(REGEX_RULE_CHARACTERS)}]+", og_search.lower())
+    return sorted(
+        {
+            fragment
+            for fragment in fragments
+            if len(fragment) >= MIN_REGEX_LITERAL_LENGTH
+        },
+        key=len,
+        reverse=True,
+    )
+
+
+def get_blob_regex_search(og_search, partial_match=True):
+    """
+    get_regex_search for names joined by newlines, every match starts at the beginning of a name
+    and can't go over its newline (the punctuation rule would match it)
+    """
+
+    search = get_regex_search(og_search, partial_match)
+    search = search.replace("[^\\w]", "[^\\w\\n]")
+    return re.compile(f"^(?:{search})", re.MULTILINE)
+
+
+def get_member_list_flat(art_database, artists, bottom=True):
+    # If bottom: will skip subgroups and go directly to the lower tier possible
+
+    member_list = []
+
+    for artist, line_up in artists:
+        if line_up == -1:
+            member_list.append(artist)
+
+        else:
+            if not bottom:
+                member_list.append(artist)
+
+            for member in get_member_list_flat(
+                art_database,
+                art_database[artist].line_ups[line_up].members,
+                bottom=bottom,
+            ):
+                member_list.append(member)
+
+    return member_list
+
+
 def format_song(artist_database, song):
 
     if song[16] == 1:
@@ -90,38 +339,36 @@ def format_song(artist_database, song):
     artists = []
     if song[23]:
 
-        for artist_id, line_up in zip(song[23].split(","), song[24].split(",")):
-            line_up = int(line_up)
-
-            artist = artist_database[str(artist_id)]
+        for artist_id, line_up in zip(song[23], song[24]):
+            artist = artist_database[artist_id]
 
             current_artist = {
                 "id": artist_id,
-                "names": artist["names"],
+                "names": artist.names,
                 "line_up_id": line_up,
             }
 
-            if artist["line_ups"] and len(artist["line_ups"]) >= line_up:
+            if artist.line_ups and len(artist.line_ups) >= line_up:
                 current_artist["members"] = []
-                for member in artist["line_ups"][line_up]["members"]:
+                for member in artist.line_ups[line_up].members:
                     current_artist["members"].append(
                         {
                             "id": member[0],
-                            "names": artist_database[str(member[0])]["names"],
+                            "names": artist_database[member[0]].names,
                         }
                     )
 
-            if artist["groups"]:
+            if artist.groups:
                 current_artist["groups"] = []
                 added_group = set()
-                for group in artist["groups"]:
+                for group in artist.groups:
                     if group[0] in added_group:
                         continue
                     added_group.add(group[0])
                     current_artist["groups"].append(
                         {
                             "id": group[0],
-                            "names": artist_database[str(group[0])]["names"],
+                            "names": artist_database[group[0]].names,
                         }
                     )
 
@@ -129,38 +376,36 @@ def format_song(artist_database, song):
 
     composers = []
     if song[27]:
-        for composer_id, line_up in zip(song[27].split(","), song[28].split(",")):
-            line_up = int(line_up)
-
-            composer = artist_database[str(composer_id)]
+        for composer_id, line_up in zip(song[27], song[28]):
+            composer = artist_database[composer_id]
 
             current_composer = {
                 "id": composer_id,
-                "names": composer["names"],
+                "names": composer.names,
                 "line_up_id": line_up,
             }
 
-            if composer["line_ups"] and len(composer["line_ups"]) >= line_up:
+            if composer.line_ups and len(composer.line_ups) >= line_up:
                 current_composer["members"] = []
-                for member in composer["line_ups"][line_up]["members"]:
+                for member in composer.line_ups[line_up].members:
                     current_composer["members"].append(
                         {
                             "id": member[0],
-                            "names": artist_database[str(member[0])]["names"],
+                            "names": artist_database[member[0]].names,
                         }
                     )
 
-            if composer["groups"]:
+            if composer.groups:
                 current_composer["groups"] = []
                 added_group = set()
-                for group in composer["groups"]:
+                for group in composer.groups:
                     if group[0] in added_group:
                         continue
                     added_group.add(group[0])
                     current_composer["groups"].append(
                         {
                             "id": group[0],
-                            "names": artist_database[str(group[0])]["names"],
+                            "names": artist_database[group[0]].names,
                         }
                     )
 
@@ -168,38 +413,36 @@ def format_song(artist_database, song):
 
     arrangers = []
     if song[31]:
-        for arranger_id, line_up in zip(song[31].split(","), song[32].split(",")):
-            line_up = int(line_up)
-
-            arranger = artist_database[str(arranger_id)]
+        for arranger_id, line_up in zip(song[31], song[32]):
+            arranger = artist_database[arranger_id]
 
             current_arranger = {
                 "id": arranger_id,
-                "names": arranger["names"],
+                "names": arranger.names,
                 "line_up_id": line_up,
             }
 
-            if arranger["line_ups"] and len(arranger["line_ups"]) >= line_up:
+            if arranger.line_ups and len(arranger.line_ups) >= line_up:
                 current_arranger["members"] = []
-                for member in arranger["line_ups"][line_up]["members"]:
+                for member in arranger.line_ups[line_up].members:
                     current_arranger["members"].append(
                         {
                             "id": member[0],
-                            "names": artist_database[str(member[0])]["names"],
+                            "names": artist_database[member[0]].names,
                         }
                     )
 
-            if arranger["groups"]:
+            if arranger.groups:
                 current_arranger["groups"] = []
                 added_group = set()
-                for group in arranger["groups"]:
+                for group in arranger.groups:
                     if group[0] in added_group:
                         continue
                     added_group.add(group[0])
                     current_arranger["groups"].append(
                         {
                             "id": group[0],
-                            "names": artist_database[str(group[0])]["names"],
+                            "names": artist_database[group[0]].names,
                         }
                     )
 
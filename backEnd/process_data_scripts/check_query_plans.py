@@ -0,0 +1,139 @@
+"""
+Check with EXPLAIN QUERY PLAN that every query sent by the API through sql_calls uses an index
+Run it after convert_to_SQL.py
+"""
+
+import re
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path("../app")))
+import sql_calls
+
+database = Path("../app/data/Enhanced-AMQ-Database.db")
+# The queries return the songs loaded by sql_calls, load them from the same database
+sql_calls.database_path = database
+
+ALL_TYPES = [1, 2, 3]
+ALL_BROADCASTS = ["Normal", "Dub", "Rebroadcast"]
+ALL_SONG_CATEGORIES = [
+    "Standard",
+    "No Category",
+    "Instrumental",
+    "Chanting",
+    "Character",
+]
+
+
+class ExplainCursor:
+    """
+    Cursor running the queries as usual while keeping their query plan
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.plans = []
+
+    def execute(self, sql_command, data=()):
+        self.plans.append(
+            self.cursor.connection.execute(
+                "EXPLAIN QUERY PLAN " + sql_command, data
+            ).fetchall()
+        )
+        return self.cursor.execute(sql_command, data)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+
+class ExplainSnapshot:
+    """
+    Database snapshot whose queries go through the explain cursor
+    """
+
+    def __init__(self, snapshot, cursor):
+        self.snapshot = snapshot
+        self.explain_cursor = cursor
+
+    def cursor(self):
+        return self.explain_cursor
+
+    def __getattr__(self, name):
+        return getattr(self.snapshot, name)
+
+
+def get_sql_calls_queries(snapshot, cursor):
+    """
+    Run every sql_calls query used by the API with sample parameters
+    """
+
+    return {
+        "get_songs_list_from_annIds": lambda: sql_calls.get_songs_list_from_annIds(
+            snapshot, [1], ALL_TYPES, ALL_BROADCASTS, ALL_SONG_CATEGORIES
+        ),
+        "get_songs_list_from_malIds": lambda: sql_calls.get_songs_list_from_malIds(
+            snapshot, [1, 2], ALL_TYPES, ALL_BROADCASTS, ALL_SONG_CATEGORIES
+        ),
+        "get_song_list_from_songArtist_name": lambda: sql_calls.get_song_list_from_songArtist_name(
+            snapshot, ["yoshino"], True, ALL_TYPES, ALL_BROADCASTS, ALL_SONG_CATEGORIES
+        ),
+        "get_artist_ids_from_names": lambda: sql_calls.get_artist_ids_from_names(
+            cursor, ["yoshino", "nanjo"], False
+        ),
+        "get_ids_from_names": lambda: sql_calls.get_ids_from_names(
+            cursor, "anime_names_fts", "annId", ["やなぎなぎ", "yanaginagi"], True
+        ),
+        "get_name_match_count": lambda: sql_calls.get_name_match_count(
+            cursor, "song_names_fts", "song_id", ["yoshino", "nanjo"], True
+        ),
+        "get_song_list_from_links": lambda: sql_calls.get_song_list_from_links(
+            snapshot, "https://files.catbox.moe/abcdef.webm"
+        ),
+    }
+
+
+def is_full_scan(plan):
+    """
+    SEARCH steps are index seeks, SCAN steps go through a whole table or a whole index
+    except for scans of a subquery result and of the full-text tables when the FTS index
+    is given a constraint (ie. "INDEX 0:L1")
+    """
+
+    for step in plan:
+        detail = step[3]
+        if (
+            detail.startswith("SCAN")
+            and not detail.startswith("SCAN (")
+            and not re.search(r"VIRTUAL TABLE INDEX \d+:\S", detail)
+        ):
+            return True
+    return False
+
+
+database_snapshot = sql_calls.get_database_snapshot()
+cursor = ExplainCursor(database_snapshot.cursor())
+snapshot = ExplainSnapshot(database_snapshot, cursor)
+
+nb_full_scans = 0
+for name, query in get_sql_calls_queries(snapshot, cursor).items():
+    cursor.plans = []
+    query()
+
+    for plan in cursor.plans:
+        if is_full_scan(plan):
+            status = "FULL SCAN"
+            nb_full_scans += 1
+        else:
+            status = "OK"
+
+        print(f"{status}: {name}")
+        for step in plan:
+            print(f"    {step[3]}")
+
+database_snapshot.connection.close()
+
+if nb_full_scans:
+    print(f"\n{nb_full_scans} queries are not using an index :(")
+    exit(1)
+
+print("\nEvery query is using an index :)")
@@ -2,18 +2,43 @@
 Convert the mapping in JSON generated by process_artists scripts to an SQL database for production use
 """
 
+import re
+import os
+import sys
 import sqlite3
 import json
+from datetime import datetime
 from pathlib import Path
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from json_stream import iter_json_items, iter_song_database
+from updatersWrapper.utils import get_song_database_path
+
+# Name folding is shared with the API so the full-text tables match its searches
+sys.path.insert(0, str(Path("../app")))
+from utils import get_name_keys
 
 database = Path("../app/data/Enhanced-AMQ-Database.db")
-song_database_path = Path("../app/data/song_database.json")
+# The build is written next to the database and renamed over it once checked,
+# so the API never sees a half-built database
+building_database = database.with_name(database.name + ".building")
+# Same file as the updaters: the JSON lines version unless the JSON is newer
+song_database_path = get_song_database_path("../app/data/song_database.json")
 artist_database_path = Path("../app/data/artist_database.json")
+change_manifest_path = Path("../app/data/change_manifest.json")
+
+# With --incremental, only the differences between the JSON and the existing database are applied
+incremental = "--incremental" in sys.argv
+
+# Rows are inserted every BULK_INSERT_BATCH_SIZE songs while the JSON is streamed
+BULK_INSERT_BATCH_SIZE = 5000
 
-with open(song_database_path, encoding="utf-8") as json_file:
-    song_database = json.load(json_file)
-with open(artist_database_path, encoding="utf-8") as json_file:
-    artist_database = json.load(json_file)
+# The animes are parsed and their rows prepared by chunks of ANIMES_PER_CHUNK in nb_processes processes,
+# only for the JSON lines song database as its chunks are plain lines the workers can parse
+ANIMES_PER_CHUNK = 200
+nb_processes = os.cpu_count() or 1
 
 
 RESET_DB_SQL = """
@@ -28,8 +53,13 @@ DROP TABLE IF EXISTS line_ups;
 DROP TABLE IF EXISTS link_artist_line_up;
 DROP TABLE IF EXISTS songs;
 DROP TABLE IF EXISTS link_song_arranger;
+DROP TABLE IF EXISTS link_song_catbox;
 DROP TABLE IF EXISTS link_song_artist;
 DROP TABLE IF EXISTS link_song_composer;
+DROP TABLE IF EXISTS artist_names_fts;
+DROP TABLE IF EXISTS song_names_fts;
+DROP TABLE IF EXISTS song_artists_fts;
+DROP TABLE IF EXISTS anime_names_fts;
 DROP VIEW IF EXISTS artistsNames;
 DROP VIEW IF EXISTS artistsGroups;
 DROP VIEW IF EXISTS lineUpsMembers;
@@ -39,7 +69,7 @@ DROP VIEW IF EXISTS songsAnimes;
 DROP VIEW IF EXISTS songsArtists;
 DROP VIEW IF EXISTS songsComposers;
 DROP VIEW IF EXISTS songsArrangers;
-DROP VIEW IF EXISTS songsFull;
+DROP VIEW IF EXISTS songsFullView;
 
 PRAGMA foreign_keys = 1;
 
@@ -105,7 +135,7 @@ CREATE TABLE link_artist_name (
     "original_name" VARCHAR(255),
     "romaji_name" VARCHAR(255) NOT NULL,
     FOREIGN KEY ("artist_id")
-        REFERENCES artist ("id"),
+        REFERENCES artists ("id"),
     UNIQUE (artist_id, romaji_name)
 );
 
@@ -117,8 +147,6 @@ CREATE TABLE link_song_artist (
         REFERENCES songs ("id"),
     FOREIGN KEY ("artist_id")
         REFERENCES artists ("id"),
-    FOREIGN KEY ("artist_line_up_id")
-        REFERENCES line_ups ("line_up_id"),
     PRIMARY KEY (song_id, artist_id, artist_line_up_id)
 );
 
@@ -151,12 +179,8 @@ create TABLE link_artist_line_up (
     "member_line_up_id" INTEGER NOT NULL,
     FOREIGN KEY ("member_id")
         REFERENCES artists ("id"),
-    FOREIGN KEY ("member_line_up_id")
-        REFERENCES groups ("line_up_id"),
-    FOREIGN KEY ("group_id")
-        REFERENCES artists ("artist_id"),
-    FOREIGN KEY ("group_line_up_id")
-        REFERENCES groups ("line_up_id"),
+    FOREIGN KEY ("group_id", "group_line_up_id")
+        REFERENCES line_ups ("artist_id", "line_up_id"),
     PRIMARY KEY (group_id, group_line_up_id, member_id, member_line_up_id)
 );
 
@@ -188,6 +212,24 @@ create TABLE link_anime_alt_name (
     PRIMARY KEY (annId, romaji_name)
 );
 
+-- Catbox file names (ie. "abcdef.webm") of the HQ, MQ and audio links of every song
+-- so a pasted link is resolved with a single key lookup
+CREATE TABLE link_song_catbox (
+    "catbox_id" VARCHAR(255) NOT NULL,
+    "song_id" INTEGER NOT NULL,
+    PRIMARY KEY (catbox_id, song_id)
+);
+
+-- Full-text name tables, names are stored folded with utils.get_name_keys
+-- the trigram tokenizer lets LIKE '%...%' searches use the index
+CREATE VIRTUAL TABLE artist_names_fts USING fts5(artist_id UNINDEXED, name, tokenize = 'trigram');
+
+CREATE VIRTUAL TABLE song_names_fts USING fts5(song_id UNINDEXED, name, tokenize = 'trigram');
+
+CREATE VIRTUAL TABLE song_artists_fts USING fts5(song_id UNINDEXED, name, tokenize = 'trigram');
+
+CREATE VIRTUAL TABLE anime_names_fts USING fts5(annId UNINDEXED, name, tokenize = 'trigram');
+
 CREATE VIEW artistsNames AS 
 SELECT orderedNames.inserted_order, artists.id, group_concat(orderedNames.original_name, "\\$") AS original_names, group_concat(orderedNames.romaji_name, "\\$") AS romaji_names, artists.disambiguation, artists.type
 FROM artists
@@ -238,7 +280,7 @@ FROM songs
 LEFT JOIN link_song_arranger ON songs.id = link_song_arranger.song_id
 GROUP BY songs.id;
 
-CREATE VIEW songsFull AS
+CREATE VIEW songsFullView AS
 SELECT songsAnimes.annId, songsAnimes.malId, songsAnimes.anidbId, songsAnimes.anilistId, songsAnimes.kitsuId, songsAnimes.originalJPName, songsAnimes.animeJPName, songsAnimes.animeENName, songsAnimes.original_alt_names, songsAnimes.romaji_alt_names, songsAnimes.animeVintage, songsAnimes.animeType, songsAnimes.animeCategory,
 songsAnimes.songId, songsAnimes.annSongId, songsAnimes.amqSongId, songsAnimes.songType, songsAnimes.songNumber, songsAnimes.songCategory, songsAnimes.originalSongName, songsAnimes.romajiSongName, songsAnimes.originalSongArtist, songsAnimes.romajiSongArtist, songsArtists.artists, songsArtists.artists_line_up, songsAnimes.originalSongComposer, songsAnimes.romajiSongComposer, songsComposers.composers, songsComposers.composers_line_up, songsAnimes.originalSongArranger, songsAnimes.romajiSongArranger, songsArrangers.arrangers, songsArrangers.arrangers_line_up, songsAnimes.songDifficulty, songsAnimes.isDub, songsAnimes.isRebroadcast, songsAnimes.songLength, songsAnimes.HQ, songsAnimes.MQ, songsAnimes.audio
 FROM songsAnimes
@@ -247,6 +289,30 @@ INNER JOIN songsComposers ON songsAnimes.songId = songsComposers.songId
 INNER JOIN songsArrangers ON songsAnimes.songId = songsArrangers.songId;
 """
 
+# songsFull is materialized from songsFullView once everything is inserted
+# so the API reads a flat indexed table instead of re-running every group_concat
+MATERIALIZE_SONGS_FULL_SQL = """
+CREATE TABLE songsFull AS SELECT * FROM songsFullView ORDER BY songId;
+
+CREATE UNIQUE INDEX idx_songsFull_songId ON songsFull (songId);
+CREATE INDEX idx_songsFull_annId ON songsFull (annId);
+CREATE INDEX idx_songsFull_malId ON songsFull (malId);
+CREATE INDEX idx_songsFull_songType ON songsFull (songType);
+CREATE INDEX idx_songsFull_animeVintage ON songsFull (animeVintage);
+"""
+
+# Secondary indexes for the lookups done by the API and the views, ANALYZE last so the planner has fresh statistics
+CREATE_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS idx_animes_malId ON animes (malId);
+CREATE INDEX IF NOT EXISTS idx_songs_annId ON songs (annId);
+CREATE INDEX IF NOT EXISTS idx_link_song_artist_artist_id ON link_song_artist (artist_id, song_id, artist_line_up_id);
+CREATE INDEX IF NOT EXISTS idx_link_song_composer_composer_id ON link_song_composer (composer_id, song_id);
+CREATE INDEX IF NOT EXISTS idx_link_song_arranger_arranger_id ON link_song_arranger (arranger_id, song_id);
+CREATE INDEX IF NOT EXISTS idx_link_artist_line_up_member_id ON link_artist_line_up (member_id, group_id, group_line_up_id);
+
+ANALYZE;
+"""
+
 
 def run_sql_command(cursor, sql_command, data=None):
     """
@@ -283,7 +349,45 @@ def run_sql_command(cursor, sql_command, data=None):
         exit()
 
 
-def insert_new_artist(cursor, id, disambiguation, type):
+# Insert statements of the bulk load, in the order the tables are filled
+BULK_INSERT_SQL = {
+    "artists": "INSERT INTO artists(id, disambiguation, type) VALUES(?, ?, ?);",
+    "link_artist_name": "INSERT INTO link_artist_name(artist_id, original_name, romaji_name) VALUES(?, ?, ?);",
+    "line_ups": "INSERT INTO line_ups(artist_id, line_up_id, line_up_type) VALUES(?, ?, ?);",
+    "link_artist_line_up": "INSERT INTO link_artist_line_up(group_id, group_line_up_id, member_id, member_line_up_id) VALUES(?, ?, ?, ?);",
+    "animes": "INSERT INTO animes(annId, malId, anidbId, anilistId, kitsuId, animeENName, originalJPName, animeJPName, animeVintage, animeType, animeCategory) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+    "link_anime_tag": "INSERT INTO link_anime_tag(annId, tag) VALUES(?, ?);",
+    "link_anime_genre": "INSERT INTO link_anime_genre(annId, genre) VALUES(?, ?);",
+    "link_anime_alt_name": "INSERT INTO link_anime_alt_name(annId, lang, original_name, romaji_name) VALUES(?, ?, ?, ?);",
+    "songs": "INSERT INTO songs(id, annSongId, amqSongId, annId, songType, songNumber, songCategory, originalSongName, romajiSongName, originalSongArtist, romajiSongArtist, originalSongComposer, romajiSongComposer, originalSongArranger, romajiSongArranger, songDifficulty, isDub, isRebroadcast, songLength, HQ, MQ, audio) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+    "link_song_artist": "INSERT INTO link_song_artist(song_id, artist_id, artist_line_up_id) VALUES(?, ?, ?);",
+    "link_song_composer": "INSERT INTO link_song_composer(song_id, composer_id, composer_line_up_id) VALUES(?, ?, ?);",
+    "link_song_arranger": "INSERT INTO link_song_arranger(song_id, arranger_id, arranger_line_up_id) VALUES(?, ?, ?);",
+}
+
+# Record each table row belongs to for the incremental build, the record ID is always the first column
+# Artists are keyed by id, animes by annId and songs by annSongId (song IDs are only internal)
+INCREMENTAL_RECORD_TABLES = {
+    "artists": ["artists", "link_artist_name", "line_ups", "link_artist_line_up"],
+    "animes": ["animes", "link_anime_tag", "link_anime_genre", "link_anime_alt_name"],
+    "songs": ["songs", "link_song_artist", "link_song_composer", "link_song_arranger"],
+}
+
+# songsFull rows of updated songs are rebuilt from the aggregated view
+REFRESH_SONGS_FULL_SQL = """
+DELETE FROM songsFull WHERE songId IN (SELECT value FROM json_each(?));
+INSERT INTO songsFull SELECT * FROM songsFullView WHERE songId IN (SELECT value FROM json_each(?)) ORDER BY songId;
+"""
+
+# Only for the build connection: nothing to recover from if the build crashes, it is restarted from the JSON
+BULK_LOAD_PRAGMAS_SQL = """
+PRAGMA journal_mode = OFF;
+PRAGMA synchronous = OFF;
+PRAGMA foreign_keys = 0;
+"""
+
+
+def insert_new_artist(rows, id, disambiguation, type):
     """
     Insert a new artist in the database
     """
@@ -292,25 +396,21 @@ def insert_new_artist(cursor, id, disambiguation, type):
         print("Error: Invalid artist type")
         exit()
 
-    sql_insert_artist = "INSERT INTO artists(id, disambiguation, type) VALUES(?, ?, ?);"
+    id = int(id)
+    rows["artists"].append((id, disambiguation, type))
 
-    run_sql_command(cursor, sql_insert_artist, [id, disambiguation, type])
+    return id
 
-    return cursor.lastrowid
 
-
-def insert_new_line_up(cursor, artist_id, line_up_id, line_up_type):
+def insert_new_line_up(rows, artist_id, line_up_id, line_up_type):
     """
     Add a new line_up configuration
     """
 
-    command = (
-        "INSERT INTO line_ups(artist_id, line_up_id, line_up_type) VALUES(?, ?, ?);"
-    )
-    run_sql_command(cursor, command, [artist_id, line_up_id, line_up_type])
+    rows["line_ups"].append((artist_id, line_up_id, line_up_type))
 
 
-def insert_artist_alt_names(cursor, id, names):
+def insert_artist_alt_names(rows, id, names):
     """
     Insert all alternative names corresponding to a single artist
     """
@@ -320,29 +420,21 @@ def insert_artist_alt_names(cursor, id, names):
         original_name = name["original_name"]
         romaji_name = name["romaji_name"]
 
-        sql_insert_artist_name = "INSERT INTO link_artist_name(artist_id, original_name, romaji_name) VALUES(?, ?, ?);"
-
-        run_sql_command(
-            cursor, sql_insert_artist_name, (id, original_name, romaji_name)
-        )
+        rows["link_artist_name"].append((id, original_name, romaji_name))
 
 
-def add_artist_to_group(cursor, group_id, group_line_up_id, artist_id, artist_line_up):
+def add_artist_to_group(rows, group_id, group_line_up_id, artist_id, artist_line_up):
     """
     Add an artist to a group
     """
 
-    sql_add_artist_to_group = "INSERT INTO link_artist_line_up(group_id, group_line_up_id, member_id, member_line_up_id) VALUES(?, ?, ?, ?)"
-
-    run_sql_command(
-        cursor,
-        sql_add_artist_to_group,
-        (group_id, group_line_up_id, artist_id, artist_line_up),
+    rows["link_artist_line_up"].append(
+        (group_id, group_line_up_id, artist_id, artist_line_up)
     )
 
 
 def insert_anime(
-    cursor,
+    rows,
     annId,
     malId,
     anidbId,
@@ -359,11 +451,7 @@ def insert_anime(
     Insert a new anime in the database
     """
 
-    sql_insert_anime = "INSERT INTO animes(annId, malId, anidbId, anilistId, kitsuId, animeENName, originalJPName, animeJPName, animeVintage, animeType, animeCategory) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"
-
-    run_sql_command(
-        cursor,
-        sql_insert_anime,
+    rows["animes"].append(
         (
             annId,
             malId,
@@ -376,12 +464,13 @@ def insert_anime(
             animeVintage,
             animeType,
             animeCategory,
-        ),
+        )
     )
 
 
 def insert_song(
-    cursor,
+    rows,
+    song_id,
     annSongId,
     amqSongId,
     annId,
@@ -400,108 +489,85 @@ def insert_song(
     isDub,
     isRebroadcast,
     songLength,
-    HQ=-1,
-    MQ=-1,
-    audio=-1,
+    HQ=None,
+    MQ=None,
+    audio=None,
 ):
     """
-    Insert a new song in the database and return the newly created song ID
-    """
-
-    data = (
-        annSongId,
-        amqSongId,
-        annId,
-        songType,
-        songNumber,
-        songCategory,
-        originalSongName,
-        romajiSongName,
-        originalSongArtist,
-        romajiSongArtist,
-        originalSongComposer,
-        romajiSongComposer,
-        originalSongArranger,
-        romajiSongArranger,
-        songDifficulty,
-        isDub,
-        isRebroadcast,
-        songLength,
-    )
+    Insert a new song in the database and return its song ID
+    """
 
-    if HQ != -1:
-        sql_insert_song = "INSERT INTO songs(annSongId, amqSongId, annId, songType, songNumber, songCategory, originalSongName, romajiSongName, originalSongArtist, romajiSongArtist, originalSongComposer, romajiSongComposer, originalSongArranger, romajiSongArranger, songDifficulty, isDub, isRebroadcast, songLength, HQ, MQ, audio) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"
-        data = (
-            *data,
+    rows["songs"].append(
+        (
+            song_id,
+            annSongId,
+            amqSongId,
+            annId,
+            songType,
+            songNumber,
+            songCategory,
+            originalSongName,
+            romajiSongName,
+            originalSongArtist,
+            romajiSongArtist,
+            originalSongComposer,
+            romajiSongComposer,
+            originalSongArranger,
+            romajiSongArranger,
+            songDifficulty,
+            isDub,
+            isRebroadcast,
+            songLength,
             HQ,
             MQ,
             audio,
         )
-    else:
-        sql_insert_song = "INSERT INTO songs(annSongId, amqSongId, annId, songType, songNumber, songCategory, originalSongName, romajiSongName, originalSongArtist, romajiSongArtist, originalSongComposer, romajiSongComposer, originalSongArranger, songDifficulty, isDub, isRebroadcast, songLength) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"
-
-    run_sql_command(cursor, sql_insert_song, data)
+    )
 
-    return cursor.lastrowid
+    return song_id
 
 
-def link_song_artist(cursor, song_id, artist_id, artist_line_up_id):
+def link_song_artist(rows, song_id, artist_id, artist_line_up_id):
     """
     Add a new link between an song and an artist in the table
     """
 
-    sql_link_song_artist = "INSERT INTO link_song_artist(song_id, artist_id, artist_line_up_id) VALUES(?, ?, ?);"
-
-    run_sql_command(
-        cursor, sql_link_song_artist, (song_id, artist_id, artist_line_up_id)
-    )
+    rows["link_song_artist"].append((song_id, artist_id, artist_line_up_id))
 
 
-def link_song_composer(cursor, song_id, composer_id, composer_line_up_id):
+def link_song_composer(rows, song_id, composer_id, composer_line_up_id):
     """
     Add a new link between an song and a composer in the table
     """
 
-    sql_link_song_composer = "INSERT INTO link_song_composer(song_id, composer_id, composer_line_up_id) VALUES(?, ?, ?);"
-
-    run_sql_command(
-        cursor, sql_link_song_composer, (song_id, composer_id, composer_line_up_id)
-    )
+    rows["link_song_composer"].append((song_id, composer_id, composer_line_up_id))
 
 
-def link_song_arranger(cursor, song_id, arranger_id, arranger_line_up_id):
+def link_song_arranger(rows, song_id, arranger_id, arranger_line_up_id):
     """
     Add a new link between an song and an arranger in the table
     """
 
-    sql_link_song_arranger = "INSERT INTO link_song_arranger(song_id, arranger_id, arranger_line_up_id) VALUES(?, ?, ?);"
+    rows["link_song_arranger"].append((song_id, arranger_id, arranger_line_up_id))
 
-    run_sql_command(
-        cursor, sql_link_song_arranger, (song_id, arranger_id, arranger_line_up_id)
-    )
 
-
-def link_anime_tag(cursor, annId, tag):
+def link_anime_tag(rows, annId, tag):
     """
     Add a new link between an anime and a tag
     """
 
-    sql_link_anime_tag = "INSERT INTO link_anime_tag(annId, tag) VALUES(?, ?);"
-
-    run_sql_command(cursor, sql_link_anime_tag, (annId, tag))
+    rows["link_anime_tag"].append((annId, tag))
 
 
-def link_anime_genre(cursor, annId, genre):
+def link_anime_genre(rows, annId, genre):
     """
     Add a new link between an anime and a genre
     """
 
-    sql_link_anime_genre = "INSERT INTO link_anime_genre(annId, genre) VALUES(?, ?);"
+    rows["link_anime_genre"].append((annId, genre))
 
-    run_sql_command(cursor, sql_link_anime_genre, (annId, genre))
 
-
-def link_anime_alt_name(cursor, annId, alt_name):
+def link_anime_alt_name(rows, annId, alt_name):
     """
     Add a new link between an anime and an alternative name
     """
@@ -510,156 +576,667 @@ def link_anime_alt_name(cursor, annId, alt_name):
     original_name = alt_name["original_name"]
     romaji_name = alt_name["romaji_name"]
 
-    sql_link_anime_altName = "INSERT INTO link_anime_alt_name(annId, lang, original_name, romaji_name) VALUES(?, ?, ?, ?);"
+    rows["link_anime_alt_name"].append((annId, lang, original_name, romaji_name))
 
-    run_sql_command(
-        cursor, sql_link_anime_altName, (annId, lang, original_name, romaji_name)
-    )
 
+def bulk_insert(cursor, rows):
+    """
+    Insert every collected row, one executemany per table, and empty the collected rows
+    """
 
-def extract_catbox_link_id(link):
+    for table, sql_insert in BULK_INSERT_SQL.items():
+        try:
+            cursor.executemany(sql_insert, rows[table])
+        except sqlite3.Error as error:
+            print(f"\nError while inserting into {table}: \n", error, "\n")
+            exit()
+        rows[table].clear()
 
-    return link.split("/")[-1] if link else None
 
+def check_foreign_keys(cursor):
+    """
+    Foreign keys are not checked during the bulk load, check them all at once at the end
+    """
 
-try:
-    sqliteConnection = sqlite3.connect(database)
-    cursor = sqliteConnection.cursor()
-    for command in RESET_DB_SQL.split(";"):
-        run_sql_command(cursor, command)
-    sqliteConnection.commit()
-    cursor.close()
-    sqliteConnection.close()
-    print("Reset successful :)")
-except sqlite3.Error as error:
-    print("\n", error, "\n")
+    violations = run_sql_command(cursor, "PRAGMA foreign_key_check;")
+    for table, rowid, parent, _ in violations[:20]:
+        print(f"Foreign key error: {table} row {rowid} references a missing {parent}")
+
+    if violations:
+        print(f"{len(violations)} foreign key errors, aborting")
+        exit()
+
+
+def get_table_columns(table):
+    """
+    Columns of a table, in the order used by its bulk insert statement
+    """
 
-try:
-    sqliteConnection = sqlite3.connect(database)
-    cursor = sqliteConnection.cursor()
-    print("Connection successful :)")
-except sqlite3.Error as error:
-    print("\n", error, "\n")
+    return re.match(r"INSERT INTO \w+\((.*?)\)", BULK_INSERT_SQL[table]).group(1)
 
 
-for artist_id in artist_database:
+def group_rows_by_record(rows):
+    """
+    Group the rows of every table by the artist, anime or song they belong to
+    Song IDs are replaced by None so songs from the JSON and from the database can be compared
+    """
+
+    song_keys = {song[0]: song[1] for song in rows["songs"]}
+
+    records = {}
+    for record_type, tables in INCREMENTAL_RECORD_TABLES.items():
+        records[record_type] = {}
+        for table in tables:
+            for row in rows[table]:
+                if record_type == "songs":
+                    key = song_keys[row[0]]
+                    row = (None, *row[1:])
+                else:
+                    key = row[0]
+
+                if key not in records[record_type]:
+                    records[record_type][key] = {table: [] for table in tables}
+                records[record_type][key][table].append(tuple(row))
+
+    return records
+
+
+def extract_database_rows(cursor):
+    """
+    Extract the rows currently in the database, in the same format as the collected JSON rows
+    """
+
+    rows = {}
+    for table in BULK_INSERT_SQL:
+        order = "inserted_order" if table == "link_artist_name" else "rowid"
+        rows[table] = run_sql_command(
+            cursor, f"SELECT {get_table_columns(table)} FROM {table} ORDER BY {order}"
+        )
+    return rows
+
 
-    new_artist_id = insert_new_artist(
+def apply_incremental_changes(cursor, rows):
+    """
+    Compare the rows collected from the JSON with the database, apply the inserts, updates and deletes
+    and return the list of changed records
+    """
+
+    database_rows = extract_database_rows(cursor)
+
+    if any(song[1] is None for song in rows["songs"]) or len(
+        {song[1] for song in rows["songs"]}
+    ) != len(rows["songs"]):
+        print("Every song needs a unique annSongId for an incremental build, aborting")
+        exit()
+
+    song_ids = {song[1]: song[0] for song in database_rows["songs"]}
+    next_song_id = max(song_ids.values(), default=0) + 1
+
+    new_records = group_rows_by_record(rows)
+    old_records = group_rows_by_record(database_rows)
+
+    changes = {}
+    for record_type, tables in INCREMENTAL_RECORD_TABLES.items():
+        new, old = new_records[record_type], old_records[record_type]
+        changes[record_type] = {
+            "inserted": [key for key in new if key not in old],
+            "updated": [key for key in new if key in old and new[key] != old[key]],
+            "deleted": [key for key in old if key not in new],
+        }
+
+        # Updated records are deleted then inserted again with the same ID
+        for key in changes[record_type]["updated"] + changes[record_type]["deleted"]:
+            record_id = song_ids[key] if record_type == "songs" else key
+            for table in tables:
+                id_column = get_table_columns(table).split(",")[0]
+                run_sql_command(
+                    cursor, f"DELETE FROM {table} WHERE {id_column} = ?;", [record_id]
+                )
+
+        for key in changes[record_type]["updated"] + changes[record_type]["inserted"]:
+            if record_type == "songs":
+                if key not in song_ids:
+                    song_ids[key] = next_song_id
+                    next_song_id += 1
+            for table in tables:
+                table_rows = new[key][table]
+                if record_type == "songs":
+                    table_rows = [(song_ids[key], *row[1:]) for row in table_rows]
+                cursor.executemany(BULK_INSERT_SQL[table], table_rows)
+
+    # Songs and animes are keyed by song IDs and annIds from here
+    for state in changes["songs"]:
+        changes["songs"][state] = [song_ids[key] for key in changes["songs"][state]]
+
+    return changes
+
+
+def refresh_derived_tables(cursor, changes):
+    """
+    Update the name tables and songsFull rows of the changed records
+    """
+
+    changed_ids = {
+        record_type: sum(record_changes.values(), [])
+        for record_type, record_changes in changes.items()
+    }
+
+    fill_name_search_tables(cursor, changed_ids)
+    fill_catbox_links(cursor, changed_ids["songs"])
+
+    # Anime information is copied in every songsFull row of the anime
+    anime_song_ids = run_sql_command(
         cursor,
-        artist_id,
-        artist_database[artist_id]["disambiguation"],
-        artist_database[artist_id]["type"],
+        "SELECT songId FROM songsFull WHERE annId IN (SELECT value FROM json_each(?))",
+        [json.dumps(changed_ids["animes"])],
     )
+    song_ids = json.dumps(changed_ids["songs"] + [id[0] for id in anime_song_ids])
 
-    insert_artist_alt_names(cursor, new_artist_id, artist_database[artist_id]["names"])
+    for command in REFRESH_SONGS_FULL_SQL.split(";"):
+        if command.strip():
+            run_sql_command(cursor, command, [song_ids])
 
-    if len(artist_database[artist_id]["members"]) > 0:
-        for i, line_up in enumerate(artist_database[artist_id]["members"]):
-            insert_new_line_up(cursor, new_artist_id, i, line_up["type"])
-            for member in line_up["members"]:
-                add_artist_to_group(cursor, new_artist_id, i, int(member[0]), member[1])
 
-nb_songs = 0
-max_songs = 9999999
-for annId in song_database:
+def write_change_manifest(changes):
+    """
+    Write the changed records so the API caches can only drop what changed
+    """
 
-    if nb_songs >= max_songs:
-        break
+    manifest = {"date": datetime.now().strftime("%d/%m/%Y %H:%M:%S"), **changes}
 
-    anime = song_database[annId]
-    insert_anime(
-        cursor,
-        anime["annId"],
+    with open(change_manifest_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+
+    for record_type, record_changes in changes.items():
+        print(
+            f"{record_type}: "
+            + " | ".join(
+                f"{len(keys)} {state}" for state, keys in record_changes.items()
+            )
+        )
+
+
+def fill_name_search_tables(cursor, record_ids=None):
+    """
+    Fill the full-text name tables with the folded names of artists, songs and animes (alt names included)
+    Original names (kana or kanji) are stored normalized and with their romaji reading, see utils.get_name_keys
+    If record_ids is given ({"artists": [...], "songs": [...], "animes": [...]}) only refresh those records
+    """
+
+    name_sources = [
         (
-            anime["linked_ids"]["myanimelist"]
-            if "linked_ids" in anime and "myanimelist" in anime["linked_ids"]
-            else None
+            "artist_names_fts",
+            "artist_id",
+            "artists",
+            """
+            SELECT artist_id AS id, romaji_name AS name FROM link_artist_name
+            UNION SELECT artist_id, original_name FROM link_artist_name
+            """,
         ),
         (
-            anime["linked_ids"]["anidb"]
-            if "linked_ids" in anime and "anidb" in anime["linked_ids"]
-            else None
+            "song_names_fts",
+            "song_id",
+            "songs",
+            """
+            SELECT id, romajiSongName AS name FROM songs
+            UNION SELECT id, originalSongName FROM songs
+            """,
         ),
         (
-            anime["linked_ids"]["anilist"]
-            if "linked_ids" in anime and "anilist" in anime["linked_ids"]
-            else None
+            "song_artists_fts",
+            "song_id",
+            "songs",
+            """
+            SELECT id, romajiSongArtist AS name FROM songs
+            UNION SELECT id, originalSongArtist FROM songs
+            """,
         ),
         (
-            anime["linked_ids"]["kitsu"]
-            if "linked_ids" in anime and "kitsu" in anime["linked_ids"]
-            else None
+            "anime_names_fts",
+            "annId",
+            "animes",
+            """
+            SELECT annId AS id, animeJPName AS name FROM animes
+            UNION SELECT annId, animeENName FROM animes
+            UNION SELECT annId, romaji_name FROM link_anime_alt_name
+            UNION SELECT annId, originalJPName FROM animes
+            UNION SELECT annId, original_name FROM link_anime_alt_name
+            """,
         ),
-        anime["animeENName"] if "animeENName" in anime else None,
-        anime["originalJPName"] if "originalJPName" in anime else None,
-        anime["animeJPName"] if "animeJPName" in anime else None,
-        anime["animeVintage"] if "animeVintage" in anime else None,
-        anime["animeType"] if "animeType" in anime else None,
-        anime["animeCategory"] if "animeCategory" in anime else None,
+    ]
+
+    for table, id_column, record_type, extract_names in name_sources:
+        data = None
+        if record_ids is not None:
+            ids = json.dumps(record_ids[record_type])
+            run_sql_command(
+                cursor,
+                f"DELETE FROM {table} WHERE {id_column} IN (SELECT value FROM json_each(?));",
+                [ids],
+            )
+            extract_names = f"SELECT id, name FROM ({extract_names}) WHERE id IN (SELECT value FROM json_each(?))"
+            data = [ids]
+
+        # The original name is often the romaji one, every (id, key) is stored once
+        names = dict.fromkeys(
+            (id, key)
+            for id, name in run_sql_command(cursor, extract_names, data)
+            if name
+            for key in get_name_keys(name)
+        )
+        cursor.executemany(
+            f"INSERT INTO {table}({id_column}, name) VALUES(?, ?);", names
+        )
+
+
+def fill_catbox_links(cursor, song_ids=None):
+    """
+    Fill link_song_catbox with the HQ, MQ and audio catbox file names of the songs
+    If song_ids is given only refresh those songs
+    """
+
+    extract_links = """
+    SELECT catbox_id, id FROM (
+        SELECT HQ AS catbox_id, id FROM songs
+        UNION SELECT MQ, id FROM songs
+        UNION SELECT audio, id FROM songs
+    ) WHERE catbox_id IS NOT NULL
+    """
+
+    data = None
+    if song_ids is not None:
+        ids = json.dumps(song_ids)
+        run_sql_command(
+            cursor,
+            "DELETE FROM link_song_catbox WHERE song_id IN (SELECT value FROM json_each(?));",
+            [ids],
+        )
+        extract_links += " AND id IN (SELECT value FROM json_each(?))"
+        data = [ids]
+
+    run_sql_command(
+        cursor,
+        f"INSERT INTO link_song_catbox (catbox_id, song_id) {extract_links}",
+        data,
     )
 
-    if "tags" in anime and anime["tags"]:
-        for tag in anime["tags"]:
-            link_anime_tag(cursor, anime["annId"], tag)
 
-    if "genres" in anime and anime["genres"]:
-        for genre in anime["genres"]:
-            link_anime_genre(cursor, anime["annId"], genre)
+def drop_songs_full(cursor):
+    """
+    Drop songsFull whether it is the old view or the materialized table
+    """
 
-    if "altNames" in anime and anime["altNames"]:
-        for altName in anime["altNames"]:
-            link_anime_alt_name(cursor, anime["annId"], altName)
+    songs_full = run_sql_command(
+        cursor, "SELECT type FROM sqlite_master WHERE name = 'songsFull';"
+    )
+    if songs_full:
+        run_sql_command(cursor, f"DROP {songs_full[0][0].upper()} songsFull;")
 
-    for song in anime["songs"]:
 
-        nb_songs += 1
+def copy_database(source, destination):
+    """
+    Copy a database with the backup API so the copy is consistent even if the source is in use
+    """
 
-        links = song["links"]
+    source_connection = sqlite3.connect(source)
+    destination_connection = sqlite3.connect(destination)
+    source_connection.backup(destination_connection)
+    destination_connection.close()
+    source_connection.close()
 
-        song_id = insert_song(
-            cursor,
-            song["annSongId"],
-            song["amqSongId"],
+
+def get_database_version(path):
+    """
+    Version stamp (PRAGMA user_version) of a database, 0 if it doesn't exist yet
+    """
+
+    if not path.exists():
+        return 0
+
+    connection = sqlite3.connect(path)
+    version = connection.execute("PRAGMA user_version;").fetchone()[0]
+    connection.close()
+    return version
+
+
+def finalize_database(cursor):
+    """
+    Check the integrity of the built database, compact it and stamp its version
+    The API compares the version stamp (PRAGMA user_version) to know when to reload its caches,
+    every build gets the version of the database it replaces plus one
+    """
+
+    integrity = run_sql_command(cursor, "PRAGMA integrity_check;")
+    if integrity != [("ok",)]:
+        print("\nIntegrity check failed, the database is not swapped:")
+        for error in integrity[:20] if integrity else []:
+            print(error[0])
+        exit()
+
+    version = get_database_version(database) + 1
+    run_sql_command(cursor, f"PRAGMA user_version = {version};")
+    run_sql_command(cursor, "VACUUM;")
+    run_sql_command(cursor, "ANALYZE;")
+
+    return version
+
+
+def extract_catbox_link_id(link):
+
+    return link.split("/")[-1] if link else None
+
+
+def prepare_rows(chunk):
+    """
+    Prepare the rows of a chunk of animes, run by the worker processes
+    chunk is a list of (anime, ID of its first song)
+    """
+
+    rows = {table: [] for table in BULK_INSERT_SQL}
+
+    for anime, song_id in chunk:
+
+        insert_anime(
+            rows,
             anime["annId"],
-            song["songType"],
-            song["songNumber"],
-            song["originalSongName"],
-            song["romajiSongName"],
-            song["originalSongArtist"],
-            song["romajiSongArtist"],
-            song["originalSongComposer"],
-            song["romajiSongComposer"],
-            song["originalSongArranger"],
-            song["romajiSongArranger"],
-            song["songDifficulty"] if "songDifficulty" in song else None,
-            song["songCategory"] if "songCategory" in song else None,
-            song["isDub"],
-            song["isRebroadcast"],
-            song["songLength"] if "songLength" in song else None,
-            extract_catbox_link_id(links["HQ"]) if "HQ" in links.keys() else None,
-            extract_catbox_link_id(links["MQ"]) if "MQ" in links.keys() else None,
-            extract_catbox_link_id(links["audio"]) if "audio" in links.keys() else None,
+            (
+                anime["linked_ids"]["myanimelist"]
+                if "linked_ids" in anime and "myanimelist" in anime["linked_ids"]
+                else None
+            ),
+            (
+                anime["linked_ids"]["anidb"]
+                if "linked_ids" in anime and "anidb" in anime["linked_ids"]
+                else None
+            ),
+            (
+                anime["linked_ids"]["anilist"]
+                if "linked_ids" in anime and "anilist" in anime["linked_ids"]
+                else None
+            ),
+            (
+                anime["linked_ids"]["kitsu"]
+                if "linked_ids" in anime and "kitsu" in anime["linked_ids"]
+                else None
+            ),
+            anime["animeENName"] if "animeENName" in anime else None,
+            anime["originalJPName"] if "originalJPName" in anime else None,
+            anime["animeJPName"] if "animeJPName" in anime else None,
+            anime["animeVintage"] if "animeVintage" in anime else None,
+            anime["animeType"] if "animeType" in anime else None,
+            anime["animeCategory"] if "animeCategory" in anime else None,
         )
 
-        for artist in song["artist_ids"]:
-            link_song_artist(cursor, song_id, int(artist[0]), artist[1])
+        if "tags" in anime and anime["tags"]:
+            for tag in anime["tags"]:
+                link_anime_tag(rows, anime["annId"], tag)
+
+        if "genres" in anime and anime["genres"]:
+            for genre in anime["genres"]:
+                link_anime_genre(rows, anime["annId"], genre)
+
+        if "altNames" in anime and anime["altNames"]:
+            for altName in anime["altNames"]:
+                link_anime_alt_name(rows, anime["annId"], altName)
+
+        for song in anime["songs"]:
+
+            links = song["links"]
+
+            insert_song(
+                rows,
+                song_id,
+                song["annSongId"],
+                song["amqSongId"],
+                anime["annId"],
+                song["songType"],
+                song["songNumber"],
+                song["originalSongName"],
+                song["romajiSongName"],
+                song["originalSongArtist"],
+                song["romajiSongArtist"],
+                song["originalSongComposer"],
+                song["romajiSongComposer"],
+                song["originalSongArranger"],
+                song["romajiSongArranger"],
+                song["songDifficulty"] if "songDifficulty" in song else None,
+                song["songCategory"] if "songCategory" in song else None,
+                song["isDub"],
+                song["isRebroadcast"],
+                song["songLength"] if "songLength" in song else None,
+                extract_catbox_link_id(links["HQ"]) if "HQ" in links.keys() else None,
+                extract_catbox_link_id(links["MQ"]) if "MQ" in links.keys() else None,
+                (
+                    extract_catbox_link_id(links["audio"])
+                    if "audio" in links.keys()
+                    else None
+                ),
+            )
+
+            for artist in song["artist_ids"]:
+                link_song_artist(rows, song_id, int(artist[0]), artist[1])
+
+            if "composer_ids" in song:
+                for composer_id, composer_line_up_id in song["composer_ids"]:
+                    link_song_composer(
+                        rows, song_id, int(composer_id), int(composer_line_up_id)
+                    )
+
+            if "arranger_ids" in song:
+                for arranger_id, arranger_line_up_id in song["arranger_ids"]:
+                    # print(song["annSongId"], arranger)
+                    link_song_arranger(
+                        rows, song_id, int(arranger_id), int(arranger_line_up_id)
+                    )
+
+            song_id += 1
+
+    return rows
+
+
+def iter_anime_chunks(max_songs):
+    """
+    Stream the animes in chunks of ANIMES_PER_CHUNK, with the ID of their first song
+    IDs are given in insertion order, like the AUTOINCREMENT of a fresh table would
+    """
 
-        if "composer_ids" in song:
-            for composer_id, composer_line_up_id in song["composer_ids"]:
-                link_song_composer(
-                    cursor, song_id, int(composer_id), int(composer_line_up_id)
-                )
+    chunk = []
+    nb_songs = 0
+    for anime in iter_song_database(song_database_path):
 
-        if "arranger_ids" in song:
-            for arranger_id, arranger_line_up_id in song["arranger_ids"]:
-                # print(song["annSongId"], arranger)
-                link_song_arranger(
-                    cursor, song_id, int(arranger_id), int(arranger_line_up_id)
-                )
+        if nb_songs >= max_songs:
+            break
+
+        chunk.append((anime, nb_songs + 1))
+        nb_songs += len(anime["songs"])
+
+        if len(chunk) >= ANIMES_PER_CHUNK:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def iter_line_chunks():
+    """
+    Stream the lines of the JSON lines song database in chunks of ANIMES_PER_CHUNK, left unparsed for the workers
+    """
 
+    with open(song_database_path, encoding="utf-8") as jsonl_file:
+        while True:
+            lines = list(islice(jsonl_file, ANIMES_PER_CHUNK))
+            if not lines:
+                return
+            yield lines
+
+
+def prepare_lines_rows(lines):
+    """
+    Parse a chunk of lines of the JSON lines song database and prepare its rows, run by the worker processes
+    Song IDs start at 1 in every chunk, shift_song_ids gives them their place once the previous chunks are known
+    """
+
+    chunk = []
+    nb_songs = 0
+    for line in lines:
+        if line.strip():
+            anime = json.loads(line)
+            chunk.append((anime, nb_songs + 1))
+            nb_songs += len(anime["songs"])
+
+    return prepare_rows(chunk), nb_songs
+
+
+def shift_song_ids(chunk_rows, offset):
+    """
+    Shift the song IDs of the rows of a chunk, the song ID is the first column of the song tables
+    """
+
+    for table in INCREMENTAL_RECORD_TABLES["songs"]:
+        chunk_rows[table] = [(row[0] + offset, *row[1:]) for row in chunk_rows[table]]
+
+
+def add_chunk_rows(cursor, rows, chunk_rows):
+    """
+    Add the rows prepared for a chunk, inserting them by batch when building from scratch
+    """
+
+    for table in rows:
+        rows[table].extend(chunk_rows[table])
+
+    # The incremental build needs every row to compare them with the database
+    if not incremental and len(rows["songs"]) >= BULK_INSERT_BATCH_SIZE:
+        bulk_insert(cursor, rows)
+
+
+def add_pool_chunks(cursor, rows, max_songs):
+    """
+    Parse the JSON lines song database and prepare its rows in the worker processes
+    this process shifts the song IDs and adds the chunks in order as the only writer,
+    a bounded number of chunks is in flight so the file is still streamed
+    """
+
+    with Pool(nb_processes) as pool:
+        pending_chunks = deque()
+        nb_songs = 0
+        lines_chunks = iter_line_chunks()
+        while True:
+            for lines in islice(lines_chunks, 2 * nb_processes - len(pending_chunks)):
+                pending_chunks.append(pool.apply_async(prepare_lines_rows, (lines,)))
+            if not pending_chunks or nb_songs >= max_songs:
+                return
+
+            chunk_rows, nb_chunk_songs = pending_chunks.popleft().get()
+            shift_song_ids(chunk_rows, nb_songs)
+            add_chunk_rows(cursor, rows, chunk_rows)
+            nb_songs += nb_chunk_songs
+
+
+# The worker processes import this script, the build itself only runs in the main process
+if __name__ == "__main__":
+
+    if building_database.exists():
+        building_database.unlink()
+
+    print(f"Reading the songs from {song_database_path.name}")
+
+    if incremental:
+        copy_database(database, building_database)
+        print("Database copied :)")
+    else:
+        try:
+            sqliteConnection = sqlite3.connect(building_database)
+            cursor = sqliteConnection.cursor()
+            drop_songs_full(cursor)
+            for command in RESET_DB_SQL.split(";"):
+                run_sql_command(cursor, command)
+            sqliteConnection.commit()
+            cursor.close()
+            sqliteConnection.close()
+            print("Reset successful :)")
+        except sqlite3.Error as error:
+            print("\n", error, "\n")
+
+    try:
+        sqliteConnection = sqlite3.connect(building_database)
+        cursor = sqliteConnection.cursor()
+        # Both builds write to their own copy, only swapped in once checked, so no journal is needed
+        for command in BULK_LOAD_PRAGMAS_SQL.split(";"):
+            run_sql_command(cursor, command)
+        print("Connection successful :)")
+    except sqlite3.Error as error:
+        print("\n", error, "\n")
+
+    rows = {table: [] for table in BULK_INSERT_SQL}
+
+    for artist_id, artist in iter_json_items(artist_database_path):
+
+        new_artist_id = insert_new_artist(
+            rows,
+            artist_id,
+            artist["disambiguation"],
+            artist["type"],
+        )
+
+        insert_artist_alt_names(rows, new_artist_id, artist["names"])
+
+        if len(artist["members"]) > 0:
+            for i, line_up in enumerate(artist["members"]):
+                insert_new_line_up(rows, new_artist_id, i, line_up["type"])
+                for member in line_up["members"]:
+                    add_artist_to_group(
+                        rows, new_artist_id, i, int(member[0]), member[1]
+                    )
+
+    max_songs = 9999999
+    if nb_processes > 1 and song_database_path.suffix == ".jsonl":
+        add_pool_chunks(cursor, rows, max_songs)
+    else:
+        # Sending parsed animes to workers costs more than preparing their rows here
+        for chunk in iter_anime_chunks(max_songs):
+            add_chunk_rows(cursor, rows, prepare_rows(chunk))
+
+    if incremental:
+        changes = apply_incremental_changes(cursor, rows)
+        print("Changes applied :)")
+
+        check_foreign_keys(cursor)
+
+        refresh_derived_tables(cursor, changes)
+        print("Name search tables, catbox links and songsFull refreshed :)")
+
+        write_change_manifest(changes)
+
+    else:
+        bulk_insert(cursor, rows)
+        print("Rows inserted :)")
+
+        check_foreign_keys(cursor)
+
+        fill_name_search_tables(cursor)
+        print("Name search tables filled :)")
+
+        fill_catbox_links(cursor)
+        print("Catbox links filled :)")
+
+        for command in MATERIALIZE_SONGS_FULL_SQL.split(";"):
+            run_sql_command(cursor, command)
+        print("songsFull materialized :)")
+
+        for command in CREATE_INDEXES_SQL.split(";"):
+            run_sql_command(cursor, command)
+        print("Indexes created :)")
+
+    sqliteConnection.commit()
+
+    version = finalize_database(cursor)
+    print(f"Integrity checked, version {version} :)")
+
+    cursor.close()
+    sqliteConnection.close()
 
-sqliteConnection.commit()
-cursor.close()
-sqliteConnection.close()
-print("Convertion Done :) - normal")
-print()
+    # Atomic rename, connections already open keep reading the previous file
+    os.replace(building_database, database)
+    print(f"Convertion Done :) - {'incremental' if incremental else 'normal'}")
+    print()
@@ -0,0 +1,123 @@
+"""
+Stream the records of the JSON databases without loading the whole file in memory
+song_database can also be stored as JSON lines (one anime per line), convert it with:
+python json_stream.py ../app/data/song_database.json ../app/data/song_database.jsonl
+"""
+
+import sys
+import json
+from pathlib import Path
+
+CHUNK_SIZE = 1 << 20
+
+
+def iter_json_items(path, chunk_size=CHUNK_SIZE):
+    """
+    Yield the (key, value) pairs of the top-level JSON object of a file ((index, value) for an array)
+    Only the current chunk and the value being parsed are kept in memory
+    """
+
+    decoder = json.JSONDecoder()
+
+    with open(path, encoding="utf-8") as json_file:
+        buffer = ""
+        position = 0
+
+        def read_more():
+            nonlocal buffer, position
+            chunk = json_file.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+            return bool(chunk)
+
+        def skip_whitespace():
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\n\r":
+                    position += 1
+                if position < len(buffer) or not read_more():
+                    return buffer[position : position + 1]
+
+        def decode():
+            nonlocal position
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # The value is cut by the end of the chunk
+                    if not read_more():
+                        raise
+                    continue
+
+                # A number might be cut too ("2." of "2.5"), it is only complete once followed by a delimiter
+                if (
+                    end == len(buffer) or buffer[end] not in ",:]} \t\n\r"
+                ) and read_more():
+                    continue
+
+                position = end
+                return value
+
+        opening = skip_whitespace()
+        if opening not in ["{", "["]:
+            raise ValueError(f"{path} is not a JSON object or array")
+        closing = "}" if opening == "{" else "]"
+        position += 1
+
+        index = 0
+        while True:
+            char = skip_whitespace()
+
+            if char == closing:
+                return
+            if char == ",":
+                position += 1
+                continue
+            if not char:
+                raise ValueError(f"Unexpected end of file in {path}")
+
+            if opening == "{":
+                key = decode()
+                if skip_whitespace() != ":":
+                    raise ValueError(f"Missing ':' after {key} in {path}")
+                position += 1
+                skip_whitespace()
+            else:
+                key = index
+
+            yield key, decode()
+            index += 1
+
+
+def iter_song_database(path):
+    """
+    Yield every anime of the song database, stored either as JSON or as JSON lines
+    """
+
+    if Path(path).suffix == ".jsonl":
+        with open(path, encoding="utf-8") as jsonl_file:
+            for line in jsonl_file:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        for _, anime in iter_json_items(path):
+            yield anime
+
+
+def write_json_lines(records, path):
+    """
+    Write the records one per line
+    """
+
+    with open(path, "w", encoding="utf-8") as jsonl_file:
+        for record in records:
+            jsonl_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python json_stream.py <song_database.json> <song_database.jsonl>")
+        exit(1)
+
+    write_json_lines(iter_song_database(sys.argv[1]), sys.argv[2])
+    print("Conversion Done :)")
@@ -5,8 +5,7 @@ import utils
 song_database_path = "../../app/data/song_database.json"
 artist_database_path = "../../app/data/artist_database.json"
 
-with open(song_database_path, encoding="utf-8") as json_file:
-    song_database = json.load(json_file)
+song_database = utils.load_song_database(song_database_path)
 with open(artist_database_path, encoding="utf-8") as json_file:
     artist_database = json.load(json_file)
 
@@ -414,8 +413,7 @@ def process():
                     print("USER CANCELLED")
                     return
 
-    with open(song_database_path, "w", encoding="utf-8") as outfile:
-        json.dump(song_database, outfile, indent=4)
+    utils.save_song_database(song_database, song_database_path)
     with open(artist_database_path, "w", encoding="utf-8") as outfile:
         json.dump(artist_database, outfile, indent=4)
 
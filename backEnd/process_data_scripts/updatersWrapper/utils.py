@@ -1,4 +1,6 @@
 import re
+import json
+from pathlib import Path
 
 ANIME_REGEX_REPLACE_RULES = [
     # Ļ can't lower correctly with sql lower function
@@ -353,3 +355,56 @@ def check_same_song(source_song, song):
     ):
         return True
     return False
+
+
+def get_song_database_path(song_database_path):
+    """
+    Song database file to read and write: its JSON lines version (one anime per line, see json_stream.py)
+    unless the JSON is newer, shared with convert_to_SQL.py so the build reads the file the updaters last wrote
+    """
+
+    json_path = Path(song_database_path).with_suffix(".json")
+    jsonl_path = json_path.with_suffix(".jsonl")
+    if not jsonl_path.exists() or (
+        json_path.exists() and json_path.stat().st_mtime > jsonl_path.stat().st_mtime
+    ):
+        return json_path
+    return jsonl_path
+
+
+def load_song_database(song_database_path):
+    """
+    Load the song database from the file picked by get_song_database_path
+    """
+
+    song_database_path = get_song_database_path(song_database_path)
+    print(f"Reading the songs from {song_database_path.name}")
+
+    if song_database_path.suffix != ".jsonl":
+        with open(song_database_path, encoding="utf-8") as json_file:
+            return json.load(json_file)
+
+    song_database = {}
+    with open(song_database_path, encoding="utf-8") as jsonl_file:
+        for line in jsonl_file:
+            if line.strip():
+                anime = json.loads(line)
+                song_database[str(anime["annId"])] = anime
+    return song_database
+
+
+def save_song_database(song_database, song_database_path):
+    """
+    Save the song database to the file it was loaded from, which stays the newest one
+    """
+
+    song_database_path = get_song_database_path(song_database_path)
+
+    if song_database_path.suffix != ".jsonl":
+        with open(song_database_path, "w", encoding="utf-8") as outfile:
+            json.dump(song_database, outfile, indent=4)
+        return
+
+    with open(song_database_path, "w", encoding="utf-8") as outfile:
+        for anime in song_database.values():
+            outfile.write(json.dumps(anime, ensure_ascii=False) + "\n")